@@ -1,12 +1,63 @@
+import json
+import logging
+import math
+import os
 import time
 from datetime import datetime
-from flask import Flask, request, jsonify
-import queue
+from flask import Flask, Response, g, request, jsonify
+import heapq
+import threading
+from collections import Counter
+from puntuacion import NodeMetricsTable, NodeScoreIndex
+from planificador import TaskScheduler, NO_REQUIREMENTS, fits, node_resources, task_requirements, task_type
+from tareas_completadas import CompletedTaskStore
+from persistencia import TaskWAL
+from series_metricas import MetricsSeriesStore, ROLLUPS
+from tendencias import TrendTracker
+from energia import DEFAULT_TASK_SECONDS, joules_per_task, node_power, packing_order, parking_candidates
+from tiempos import RuntimeModel
+from instrumentacion import MetricsRegistry, SamplingProfiler, WAIT_BUCKETS, configure_logging
+
+log = logging.getLogger("agente")
+
+# Campos de métricas que envían los esclavos en /update_metrics
+METRIC_FIELDS = ("cpu_cores", "cpu_percent", "ram_total_GB", "ram_percent", "cpu_temp", "power_watts")
+# Margen para relojes de nodo adelantados: un timestamp de muestra más allá se rechaza
+MAX_CLOCK_SKEW = 86400
+# Cesiones confirmadas que se recuerdan para responder igual a una confirmación repetida
+MAX_MIGRATED = 10000
+# Segundos que vale el conjunto de nodos aparcados que consulta /request_task en modo consolidate
+PARKING_REFRESH = 1.0
+
+# Perfil de pesos que genera ajuste_pesos.py; si existe, los __main__ lo usan en lugar de custom_weights
+WEIGHTS_PROFILE = "pesos.json"
+
+# Multiplicadores de los pesos según system_load (se sustituyen con load_multipliers)
+LOAD_MULTIPLIERS = {
+    "low": {"energy_efficiency": 1.5, "cpu_availability": 0.7},
+    "high": {"cpu_availability": 1.3, "temperature": 1.3, "energy_efficiency": 0.5}
+}
+
+
+def load_weight_profile(path):
+    """Lee un perfil de pesos (JSON de ajuste_pesos.py): devuelve (weights, load_multipliers o None)"""
+    with open(path, encoding="utf-8") as f:
+        profile = json.load(f)
+    return profile["weights"], profile.get("load_multipliers")
 
 
 class MasterAgent:
-    def __init__(self, weights=None):
-        # ... (tu código anterior de ponderaciones y config) ...
+    def __init__(self, weights=None, completed_capacity=1000, completed_db=None,
+                 wal_dir=None, wal_sync=True, snapshot_every=10000,
+                 lease_seconds=300, heartbeat_timeout=60, metrics_db=None,
+                 scoring="instant", forecast_horizon=10, trend_tau=(10.0, 30.0), clock=time.time,
+                 load_multipliers=None, consolidate=False, placement="score",
+                 task_id_offset=0, task_id_stride=1):
+        # weights puede ser un dict o la ruta de un perfil guardado por ajuste_pesos.py
+        if isinstance(weights, str):
+            weights, profile_multipliers = load_weight_profile(weights)
+            load_multipliers = load_multipliers or profile_multipliers
+        self.load_multipliers = load_multipliers or LOAD_MULTIPLIERS
         self.weights = weights or {
             "cpu_availability": 0.30,
             "ram_availability": 0.25,
@@ -19,264 +70,1284 @@ class MasterAgent:
             "temp_max": 85,
             "temp_warning": 75,
             "ram_critical": 95,
-            "cpu_critical": 95
+            "cpu_critical": 95,
+            # Carga del clúster según la CPU media (get_system_load)
+            "low_load_cpu": 30,
+            "high_load_cpu": 70,
+            # Consolidación: un nodo está ocioso por debajo de idle_cpu y se llena hasta pack_cpu_max
+            "idle_cpu": 15,
+            "pack_cpu_max": 80,
+            # placement="ect": nodos de mejor puntuación (del índice) entre los que se busca el más rápido
+            "ect_candidates": 32
         }
 
+        # Con consolidate, en carga baja el trabajo se concentra en los nodos con menos julios
+        # por tarea y los nodos ociosos que sobran se marcan para aparcarlos
+        self.consolidate = consolidate
+        self._parked = None  # (caduca_en, nodos aparcados), ver is_parked
+
+        # Colocación "score" (mejor puntuación, por defecto) o "ect": de los config["ect_candidates"]
+        # nodos mejor puntuados, el que terminaría antes la tarea según los tiempos de ejecución de
+        # cada (nodo, tipo de tarea) en runtime_model. Es opcional: no gana en todas las trazas
+        # (ver bench_placement en benchmark.py)
+        if placement not in ("score", "ect"):
+            raise ValueError("placement debe ser 'score' o 'ect'")
+        self.placement = placement
+
+        # Reloj de leases, latidos y tiempos de ejecución (el simulador pasa uno virtual)
+        self.clock = clock
+
+        # Latencias, contadores y gauges del maestro para /metrics
+        self.metrics = MetricsRegistry()
+        self._instrument()
+
+        # Concurrencia: un lock para el estado de los nodos y otro para el de las tareas.
+        # Nunca se toma _task_lock teniendo _nodes_lock.
+        self._nodes_lock = threading.RLock()  # nodes_data, energy_consumption, performance_history, runtime_model, índices
+        self._task_lock = threading.Lock()  # task_queue, task_id_counter, active_tasks, completed_tasks
+        self._task_available = threading.Condition(self._task_lock)  # long-poll de get_next_tasks_for_node
+
         self.energy_consumption = {}
         self.performance_history = {}
+        # Media, varianza y cuantiles del tiempo de cada (nodo, tipo de tarea) completada con éxito
+        self.runtime_model = RuntimeModel(DEFAULT_TASK_SECONDS)
         self.decision_log = []
         self.nodes_data = {}
+        self._free_resources = {}  # {node_id: node_resources(nodes_data[node_id])}, al día con cada muestra
+        # Historial de métricas por nodo (anillos en memoria; con metrics_db también en cluster_metrics)
+        self.metrics_series = MetricsSeriesStore(db_path=metrics_db)
+
+        # Puntuación por lotes: columnas NumPy, pesos normalizados cacheados y máximo de energía
+        self.metrics_table = NodeMetricsTable()
+        self._weights_cache = {}
+        self._max_energy = None
+
+        # Puntuación "instant" (última muestra) o "trend": carga prevista a forecast_horizon segundos
+        # con EWMA y tendencia lineal por nodo (trend_tau = constantes de tiempo de nivel y tendencia)
+        if scoring not in ("instant", "trend"):
+            raise ValueError("scoring debe ser 'instant' o 'trend'")
+        self.scoring = scoring
+        self.forecast_horizon = forecast_horizon
+        self.trends = TrendTracker(*trend_tau)
 
-        # NUEVO: Cola de tareas pendientes
-        self.task_queue = queue.Queue()
+        # Índice de nodos por puntuación para obtener el mejor nodo en O(log N)
+        self.score_index = NodeScoreIndex()
+        self._index_key = None  # pesos y máximo de energía con los que se construyó
+
+        # Cola de tareas pendientes por prioridad y requisitos (task_data['priority'/'requirements'])
+        self.task_queue = TaskScheduler()
         self.active_tasks = {}  # {task_id: {node_id, start_time, task_data}}
-        self.completed_tasks = []
+        # Últimas completed_capacity en memoria; las anteriores a SQLite (completed_db) o descartadas
+        self.completed_tasks = CompletedTaskStore(completed_capacity, completed_db)
         self.task_id_counter = 0
+        # IDs task_id_counter * task_id_stride + task_id_offset: en una federación cada maestro
+        # usa su propio desplazamiento y los IDs no se repiten entre shards
+        self.task_id_offset = task_id_offset
+        self.task_id_stride = task_id_stride
+
+        # Leases: cada tarea asignada vence en lease_seconds (o task_data['lease_seconds']);
+        # los nodos sin latido en heartbeat_timeout segundos se expulsan del clúster
+        self.lease_seconds = lease_seconds
+        self.heartbeat_timeout = heartbeat_timeout
+        self._lease_heap = []  # (deadline, task_id), las entradas de tareas ya cerradas se ignoran
+        # Cesiones ya confirmadas {task_id: holder}, para responder igual si se repite la confirmación
+        self._migrated = {}
+        self.last_seen = {}  # {node_id: último /update_metrics}
+        self._reaper = None
+        self._reaper_stop = threading.Event()
+
+        # Modo duradero: add_task, asignaciones, completadas y registros van al WAL de wal_dir.
+        # Con wal_sync, add_task no devuelve hasta que la tarea está en disco.
+        self.wal = None
+        self.wal_sync = wal_sync
+        self.snapshot_every = snapshot_every
+        self._compacting = threading.Lock()
+        if wal_dir:
+            wal = TaskWAL(wal_dir)
+            self._recover_from_wal(wal)
+            self.wal = wal
+            self.compact_wal()
+
+    def _instrument(self):
+        metrics = self.metrics
+        self._score_latency = metrics.histogram(
+            "master_score_seconds", "Duración de calculate_node_score")
+        self._assign_latency = metrics.histogram(
+            "master_get_next_task_seconds", "Selección y asignación de tareas a un nodo, sin la espera del long-poll")
+        self._complete_latency = metrics.histogram(
+            "master_complete_task_seconds", "Duración de complete_task")
+        self._queue_wait = metrics.histogram(
+            "master_task_queue_wait_seconds", "Tiempo de una tarea en la cola hasta que se asigna", WAIT_BUCKETS)
+        self._tasks_added = metrics.counter("master_tasks_added_total", "Tareas añadidas a la cola")
+        self._tasks_assigned = metrics.counter("master_tasks_assigned_total", "Tareas asignadas a nodos")
+        self._tasks_completed = metrics.counter(
+            "master_tasks_completed_total", "Tareas completadas", labelnames=("success",))
+        self._leases_expired = metrics.counter("master_leases_expired_total", "Leases vencidos y reencolados")
+        self._handoffs_expired = metrics.counter(
+            "master_handoffs_expired_total", "Cesiones a otro maestro sin confirmar y reencoladas")
+        self._nodes_evicted = metrics.counter("master_nodes_evicted_total", "Nodos expulsados sin latido")
+        metrics.gauge("master_pending_tasks", "Tareas en cola", lambda: self.task_queue.qsize())
+        metrics.gauge("master_active_tasks", "Tareas asignadas sin completar", lambda: len(self.active_tasks))
+        metrics.gauge("master_nodes", "Nodos con métricas", lambda: len(self.nodes_data))
+        # Instante en que cada tarea pendiente entró en la cola (bajo _task_lock)
+        self._enqueued_at = {}
+
+    def _log(self, record):
+        """Añade un registro al WAL (si está activo) y devuelve su secuencia"""
+        if self.wal is None:
+            return 0
+        return self.wal.append(record)
 
     def add_task(self, task_data):
         """Añade una tarea a la cola"""
-        self.task_id_counter += 1
-        task = {
-            'task_id': self.task_id_counter,
-            'data': task_data,
-            'created_at': datetime.now().isoformat()
-        }
-        self.task_queue.put(task)
-        print(f"➕ Tarea {task['task_id']} añadida a la cola")
+        created_at = datetime.fromtimestamp(self.clock()).isoformat()
+        with self._task_available:
+            # ID atómico: se reserva y se encola bajo el mismo lock
+            self.task_id_counter += 1
+            task = {
+                'task_id': self.task_id_counter * self.task_id_stride + self.task_id_offset,
+                'data': task_data,
+                'created_at': created_at
+            }
+            self.task_queue.put(task)
+            self._enqueued_at[task['task_id']] = self.clock()
+            seq = self._log({'op': 'add', 'task': task})
+            # Una tarea sin requisitos le sirve a cualquiera; si los tiene, se despierta a todos
+            # para que la recoja un nodo en el que quepa
+            if task_requirements(task) == NO_REQUIREMENTS:
+                self._task_available.notify()
+            else:
+                self._task_available.notify_all()
+
+        if seq and self.wal_sync:
+            self.wal.wait(seq)  # Commit agrupado: varias tareas comparten el mismo fsync
+        self._maybe_compact()
+        self._tasks_added.inc()
+        log.debug("➕ Tarea %s añadida a la cola", task['task_id'])
         return task['task_id']
 
-    def get_next_task_for_node(self, node_id):
+    def release_tasks(self, holder, free=None, max_tasks=1, handoff_seconds=30):
+        """Cede hasta max_tasks tareas que caben en 'free' a otro maestro ('holder').
+
+        Nunca más de la mitad de la cola (redondeando hacia arriba), para que el que cede
+        no se quede sin trabajo y las tareas no vayan y vuelvan entre shards. Las tareas
+        quedan con un lease de handoff_seconds a nombre de holder hasta que confirm_handoff
+        las da por entregadas; si no llega la confirmación, el segador las reencola.
+        """
+        tasks = []
+        seq = 0
+        with self._task_lock:
+            limit = min(max_tasks, (self.task_queue.qsize() + 1) // 2)
+            start_time = self.clock()
+            while len(tasks) < limit:
+                task = self.task_queue.get_for(free)
+                if task is None:
+                    break
+                self._enqueued_at.pop(task['task_id'], None)
+                lease = self._new_lease(holder, start_time, task, handoff_seconds)
+                lease['handoff'] = True
+                self.active_tasks[task['task_id']] = lease
+                tasks.append(task)
+            if tasks:
+                seq = self._log({'op': 'lease', 'node_id': holder, 'start_time': start_time, 'handoff': True,
+                                 'lease_seconds': handoff_seconds, 'task_ids': [task['task_id'] for task in tasks]})
+        if seq and self.wal_sync:
+            self.wal.wait(seq)
+        return tasks
+
+    def confirm_handoff(self, task_ids, holder=None):
+        """El otro maestro ya tiene las tareas cedidas: dejan de estar activas aquí.
+
+        Con holder solo se confirman las cedidas a ese maestro, y es idempotente: si se
+        perdió la respuesta y lo reintenta, las que ya confirmó vuelven a contar.
+        """
+        with self._task_lock:
+            confirmed, repeated = [], []
+            for task_id in task_ids:
+                info = self.active_tasks.get(task_id)
+                if info is not None and info.get('handoff') and holder in (None, info['node_id']):
+                    confirmed.append(task_id)
+                    del self.active_tasks[task_id]
+                    self._remember_migrated(task_id, info['node_id'])
+                elif holder is not None and self._migrated.get(task_id) == holder:
+                    repeated.append(task_id)
+            if confirmed:
+                self._log({'op': 'migrate', 'task_ids': confirmed, 'holder': holder})
+        return confirmed + repeated
+
+    def _remember_migrated(self, task_id, holder):
+        self._migrated[task_id] = holder
+        if len(self._migrated) > MAX_MIGRATED:
+            del self._migrated[next(iter(self._migrated))]  # La más antigua
+
+    def adopt_tasks(self, tasks):
+        """Encola tareas cedidas por otro maestro conservando su task_id"""
+        seq = 0
+        with self._task_available:
+            now = self.clock()
+            for task in tasks:
+                self.task_queue.put(task)
+                self._enqueued_at[task['task_id']] = now
+                seq = self._log({'op': 'add', 'task': task})
+            if tasks:
+                self._task_available.notify_all()
+        if seq and self.wal_sync:
+            self.wal.wait(seq)
+
+    def get_next_task_for_node(self, node_id, timeout=0):
         """Obtiene la siguiente tarea para un nodo específico"""
-        if self.task_queue.empty():
-            return None
+        tasks = self.get_next_tasks_for_node(node_id, 1, timeout)
+        return tasks[0] if tasks else None
 
-        try:
-            task = self.task_queue.get_nowait()
-            self.active_tasks[task['task_id']] = {
-                'node_id': node_id,
-                'start_time': time.time(),
-                'task_data': task
-            }
-            print(f"📤 Tarea {task['task_id']} asignada a {node_id}")
-            return task
-        except queue.Empty:
-            return None
+    def get_next_tasks_for_node(self, node_id, max_tasks=1, timeout=0):
+        """Asigna de una vez hasta max_tasks tareas a un nodo.
+
+        Se eligen las de mayor prioridad cuyos requisitos caben en los recursos libres
+        del nodo. Con timeout > 0 espera (long-poll) hasta que add_task encole algo
+        que le sirva o venza el plazo.
+        """
+        tasks = []
+        if timeout <= 0 and self.task_queue.empty():
+            return tasks
+        started = time.perf_counter()
+        # Recursos y tiempos leídos antes de tomar _task_lock (nunca _task_lock dentro de _nodes_lock)
+        free = self.get_node_resources(node_id)
+        cost = self._relative_runtime_cost(node_id) if self.placement == "ect" else None
+
+        # Bajo _task_lock: el lote entero aparece a la vez en active_tasks
+        with self._task_available:
+            if timeout > 0:
+                # wait_for suelta el lock mientras espera; lo despierta el notify() de add_task.
+                # La espera no cuenta en la latencia de la asignación.
+                waiting = time.perf_counter()
+                self._task_available.wait_for(lambda: self.task_queue.has_task_for(free), timeout)
+                started += time.perf_counter() - waiting
+            start_time = self.clock()
+            while len(tasks) < max_tasks:
+                task = self.task_queue.get_for(free, cost)
+                if task is None:
+                    break
+                self.active_tasks[task['task_id']] = self._new_lease(node_id, start_time, task)
+                tasks.append(task)
+                enqueued = self._enqueued_at.pop(task['task_id'], None)
+                if enqueued is not None:
+                    self._queue_wait.observe(start_time - enqueued)
+            if tasks:
+                self._log({'op': 'lease', 'node_id': node_id, 'start_time': start_time,
+                           'task_ids': [task['task_id'] for task in tasks]})
+
+        self._maybe_compact()
+        self._assign_latency.observe(time.perf_counter() - started)
+
+        if tasks:
+            self._tasks_assigned.inc(amount=len(tasks))
+            log.debug("📤 Tareas %s asignadas a %s", [task['task_id'] for task in tasks], node_id)
+        return tasks
+
+    def _relative_runtime_cost(self, node_id):
+        """Coste por tipo de tarea para el nodo: su duración esperada relativa a la media del tipo.
+
+        Entre tareas de la misma prioridad el nodo se queda con los tipos en los que es más
+        rápido que el resto; se redondea a décimas para que con diferencias pequeñas mande
+        la antigüedad y ningún tipo se quede atrás.
+        """
+        with self._nodes_lock:
+            factor = self.runtime_model.node_factor(node_id)
+            known = {kind: round(self.runtime_model.relative(node_id, kind), 1)
+                     for kind in self.runtime_model.task_types()}
+        unknown = round(factor, 1)
+        return lambda kind: known.get(kind, unknown)
+
+    def _new_lease(self, node_id, start_time, task, lease_seconds=None):
+        """Entrada de active_tasks con su plazo; se apunta en el montículo de vencimientos"""
+        data = task.get('data')
+        if lease_seconds is None:
+            lease_seconds = data.get('lease_seconds', self.lease_seconds) if isinstance(data, dict) else self.lease_seconds
+        deadline = start_time + lease_seconds
+        heapq.heappush(self._lease_heap, (deadline, task['task_id']))
+        return {
+            'node_id': node_id,
+            'start_time': start_time,
+            'deadline': deadline,
+            'task_data': task
+        }
+
+    def reap_expired_leases(self, now=None, dead_nodes=()):
+        """Reencola las tareas con el lease vencido (o de nodos expulsados) y anota el fallo"""
+        now = self.clock() if now is None else now
+        expired = []
+        with self._task_available:
+            while self._lease_heap and self._lease_heap[0][0] <= now:
+                deadline, task_id = heapq.heappop(self._lease_heap)
+                info = self.active_tasks.get(task_id)
+                # Si la tarea se reasignó después, esta entrada es de un lease anterior
+                if info is not None and info['deadline'] == deadline:
+                    expired.append(task_id)
+            if dead_nodes:
+                dead_nodes, already = set(dead_nodes), set(expired)
+                expired += [task_id for task_id, info in self.active_tasks.items()
+                            if info['node_id'] in dead_nodes and task_id not in already]
+
+            leases = []
+            for task_id in expired:
+                info = self.active_tasks.pop(task_id)
+                self.task_queue.put(info['task_data'])
+                self._enqueued_at[task_id] = now
+                leases.append(info)
+            if leases:
+                self._log({'op': 'requeue', 'task_ids': expired})
+                self._task_available.notify_all()
+
+        # El fallo cuenta en el historial del nodo, igual que una tarea completada sin éxito
+        handoffs = 0
+        for task_id, info in zip(expired, leases):
+            if info.get('handoff'):
+                log.warning("⏰ Cesión de la tarea %s a %s sin confirmar: vuelve a la cola", task_id, info['node_id'])
+                handoffs += 1
+                continue
+            elapsed_time = now - info['start_time']
+            with self._nodes_lock:
+                # 'fail' solo toca el historial: entre el requeue y este registro otro nodo puede
+                # haber cogido la tarea, y al reproducir el WAL su lease no se puede perder
+                self._log({'op': 'fail', 'task_id': task_id, 'node_id': info['node_id'],
+                           'elapsed_time': elapsed_time})
+                self.update_performance(info['node_id'], elapsed_time, success=False)
+            log.warning("⏰ Lease de la tarea %s vencido en %s: vuelve a la cola", task_id, info['node_id'])
+        self._leases_expired.inc(amount=len(expired) - handoffs)
+        self._handoffs_expired.inc(amount=handoffs)
+        return expired
+
+    def evict_silent_nodes(self, now=None):
+        """Expulsa los nodos que no envían métricas desde hace heartbeat_timeout segundos"""
+        now = self.clock() if now is None else now
+        with self._nodes_lock:
+            silent = [node_id for node_id, seen in self.last_seen.items()
+                      if now - seen > self.heartbeat_timeout]
+            for node_id in silent:
+                log.warning("💀 Nodo %s expulsado: sin métricas desde hace %.0fs", node_id, now - self.last_seen[node_id])
+                self._remove_node(node_id)
+                self._log({'op': 'evict', 'node_id': node_id})
+        self._nodes_evicted.inc(amount=len(silent))
+        return silent
+
+    def _remove_node(self, node_id):
+        """Quita un nodo del conjunto que se puntúa (el historial de rendimiento se conserva)"""
+        self.nodes_data.pop(node_id, None)
+        self._free_resources.pop(node_id, None)
+        self.last_seen.pop(node_id, None)
+        energy_watts = self.energy_consumption.pop(node_id, None)
+        self.metrics_table.remove(node_id)
+        self.score_index.remove(node_id)
+        self.trends.remove(node_id)
+        if energy_watts is not None and energy_watts == self._max_energy:
+            self._max_energy = max(self.energy_consumption.values()) if self.energy_consumption else None
+
+    def reap(self, now=None):
+        """Una pasada del segador: expulsa nodos muertos y recupera sus tareas y las vencidas"""
+        dead_nodes = self.evict_silent_nodes(now)
+        return dead_nodes, self.reap_expired_leases(now, dead_nodes)
+
+    def start_reaper(self, interval=5):
+        """Lanza el segador en un hilo de fondo cada 'interval' segundos"""
+        def run():
+            while not self._reaper_stop.wait(interval):
+                try:
+                    self.reap()
+                except Exception:
+                    log.exception("❌ Error en el segador de leases")
+
+        self._reaper_stop.clear()
+        self._reaper = threading.Thread(target=run, daemon=True, name="segador")
+        self._reaper.start()
+
+    def stop_reaper(self):
+        self._reaper_stop.set()
+        if self._reaper is not None:
+            self._reaper.join()
+            self._reaper = None
+
+    def get_node_resources(self, node_id):
+        """Núcleos, RAM (GB) libres y temperatura del nodo; None si no ha enviado métricas"""
+        with self._nodes_lock:
+            free = self._free_resources.get(node_id)
+            return dict(free) if free is not None else None  # Copia: get_for descuenta de ella
+
+    def get_node_capacity(self, node_id):
+        """Número de tareas que un nodo puede aceptar a la vez (sus núcleos, mínimo 1)"""
+        with self._nodes_lock:
+            cores = self.nodes_data.get(node_id, {}).get("cpu_cores")
+        return max(1, int(cores or 1))
 
     def complete_task(self, task_id, node_id, result, success=True):
         """Marca una tarea como completada"""
-        if task_id in self.active_tasks:
-            task_info = self.active_tasks[task_id]
-            elapsed_time = time.time() - task_info['start_time']
-
-            # Actualizar historial de rendimiento del nodo
-            self.update_performance(node_id, elapsed_time, success)
-
-            # Guardar resultado
-            self.completed_tasks.append({
-                'task_id': task_id,
-                'node_id': node_id,
-                'elapsed_time': elapsed_time,
-                'success': success,
-                'result': result,
-                'completed_at': datetime.now().isoformat()
-            })
+        with self._complete_latency.time():
+            with self._task_lock:
+                task_info = self.active_tasks.get(task_id)
+                if task_info is not None and task_info['node_id'] != node_id:
+                    # Completada tarde por un nodo cuyo lease venció o que fue expulsado: el lease
+                    # es ahora de otro nodo. Se ignora, pero el resultado queda en el WAL.
+                    self._log({'op': 'stale_complete', 'task_id': task_id, 'node_id': node_id,
+                               'holder': task_info['node_id'], 'success': success, 'result': result})
+                    log.warning("⚠️ Tarea %s completada por %s pero su lease es de %s: se ignora",
+                                task_id, node_id, task_info['node_id'])
+                    return False
+                # pop atómico: si dos peticiones completan la misma tarea solo una cuenta
+                task_info = self.active_tasks.pop(task_id, None)
+                if task_info is None:
+                    return False
+                elapsed_time = self.clock() - task_info['start_time']
+
+                # Guardar resultado
+                self.completed_tasks.append({
+                    'task_id': task_id,
+                    'node_id': node_id,
+                    'elapsed_time': elapsed_time,
+                    'success': success,
+                    'result': result,
+                    'completed_at': datetime.fromtimestamp(self.clock()).isoformat()
+                })
 
-            del self.active_tasks[task_id]
-            print(f"✅ Tarea {task_id} completada por {node_id} en {elapsed_time:.2f}s")
+            # Actualizar historial de rendimiento del nodo (fuera de _task_lock). El registro del WAL
+            # va bajo _nodes_lock junto con el historial para que un snapshot vea ambos o ninguno.
+            kind = task_type(task_info['task_data'])
+            with self._nodes_lock:
+                self._log({'op': 'complete', 'task_id': task_id, 'node_id': node_id,
+                           'elapsed_time': elapsed_time, 'success': success, 'task_type': kind})
+                self.update_performance(node_id, elapsed_time, success, kind)
+
+            self._maybe_compact()
+            self._tasks_completed.inc(str(bool(success)).lower())
+            log.debug("✅ Tarea %s completada por %s en %.2fs", task_id, node_id, elapsed_time)
             return True
-        return False
+
+    def complete_tasks(self, node_id, results):
+        """Completa un lote de tareas [{task_id, result, success}], devuelve (completadas, no encontradas)"""
+        completed, not_found = [], []
+        for item in results:
+            task_id = item.get('task_id')
+            if self.complete_task(task_id, node_id, item.get('result'), item.get('success', True)):
+                completed.append(task_id)
+            else:
+                not_found.append(task_id)
+        return completed, not_found
 
     def get_queue_status(self):
         """Devuelve el estado de la cola de tareas"""
+        with self._task_lock:
+            return {
+                'pending_tasks': self.task_queue.qsize(),
+                'active_tasks': len(self.active_tasks),
+                'completed_tasks': len(self.completed_tasks)
+            }
+
+    def _recover_from_wal(self, wal):
+        """Reconstruye cola, tareas activas e historial a partir del snapshot y el log"""
+        snapshot, records = wal.load()
+        pending = {}  # {task_id: tarea}
+        if snapshot:
+            self.task_id_counter = snapshot['task_id_counter']
+            pending = {task['task_id']: task for task in snapshot['pending']}
+            self.active_tasks = {int(task_id): info for task_id, info in snapshot['active'].items()}
+            for task_id, info in self.active_tasks.items():
+                heapq.heappush(self._lease_heap, (info['deadline'], task_id))
+            for node_id, energy_watts in snapshot['energy_consumption'].items():
+                self.register_node(node_id, energy_watts)
+            self.performance_history.update(snapshot['performance_history'])
+            if 'runtime_model' in snapshot:
+                self.runtime_model.load(snapshot['runtime_model'])
+
+        for record in records:
+            op = record['op']
+            if op == 'add':
+                task = record['task']
+                pending[task['task_id']] = task
+                self.task_id_counter = max(self.task_id_counter,
+                                           (task['task_id'] - self.task_id_offset) // self.task_id_stride)
+            elif op == 'lease':
+                for task_id in record['task_ids']:
+                    task = pending.pop(task_id, None)
+                    if task is not None:
+                        # Las cesiones llevan su propio plazo (handoff_seconds), no el del lease normal
+                        self.active_tasks[task_id] = self._new_lease(record['node_id'], record['start_time'], task,
+                                                                     record.get('lease_seconds'))
+                        if record.get('handoff'):
+                            self.active_tasks[task_id]['handoff'] = True
+            elif op == 'migrate':
+                for task_id in record['task_ids']:
+                    info = self.active_tasks.pop(task_id, None)
+                    holder = record.get('holder') or (info['node_id'] if info is not None else None)
+                    self._remember_migrated(task_id, holder)
+            elif op == 'requeue':
+                for task_id in record['task_ids']:
+                    info = self.active_tasks.pop(task_id, None)
+                    if info is not None:
+                        pending[task_id] = info['task_data']
+            elif op == 'evict':
+                self._remove_node(record['node_id'])
+            elif op == 'complete':
+                # La tarea puede no estar activa si el snapshot se hizo justo antes de este registro;
+                # solo se quita el lease si es del nodo que la completó
+                info = self.active_tasks.get(record['task_id'])
+                if info is not None and info['node_id'] == record['node_id']:
+                    del self.active_tasks[record['task_id']]
+                self.update_performance(record['node_id'], record['elapsed_time'], record['success'],
+                                        record.get('task_type'))
+            elif op == 'fail':
+                self.update_performance(record['node_id'], record['elapsed_time'], success=False)
+            elif op == 'register':
+                self.register_node(record['node_id'], record['energy_watts'])
+
+        for task in pending.values():
+            self.task_queue.put(task)
+        # Los cambios de success_rate tienen que llegar a las columnas de puntuación
+        for node_id, perf in self.performance_history.items():
+            self.metrics_table.set_success_rate(node_id, perf['success_rate'])
+        log.info("♻️ Recuperadas %d tareas pendientes y %d activas", len(pending), len(self.active_tasks))
+
+    def compact_wal(self):
+        """Guarda un snapshot del estado y vacía el WAL para que el arranque sea rápido"""
+        if self.wal is None:
+            return
+        with self._task_lock, self._nodes_lock:
+            self.wal.write_snapshot({
+                'task_id_counter': self.task_id_counter,
+                'pending': list(self.task_queue.queue),
+                'active': self.active_tasks,
+                'energy_consumption': self.energy_consumption,
+                'performance_history': self.performance_history,
+                'runtime_model': self.runtime_model.to_dict()
+            })
+
+    def _maybe_compact(self):
+        if self.wal is None or self.wal.records_since_snapshot < self.snapshot_every:
+            return
+        if self._compacting.acquire(blocking=False):  # Solo un hilo compacta
+            try:
+                if self.wal.records_since_snapshot >= self.snapshot_every:
+                    self.compact_wal()
+            finally:
+                self._compacting.release()
+
+    def close(self):
+        """Cierra los ficheros del modo duradero"""
+        if self.wal is not None:
+            self.wal.close()
+        self.completed_tasks.close()
+        self.metrics_series.close()
+
+    def get_nodes_snapshot(self):
+        """Copia consistente de nodes_data para leer sin bloquear a los escritores"""
+        with self._nodes_lock:
+            return {node_id: dict(data) for node_id, data in self.nodes_data.items()}
+
+    def get_status_snapshot(self):
+        """Copia consistente del estado del clúster para /status"""
+        nodes = self.get_nodes_snapshot()
+        with self._task_lock:
+            active_tasks = {task_id: dict(info) for task_id, info in self.active_tasks.items()}
+            queue_status = {
+                'pending_tasks': self.task_queue.qsize(),
+                'active_tasks': len(self.active_tasks),
+                'completed_tasks': len(self.completed_tasks)
+            }
         return {
-            'pending_tasks': self.task_queue.qsize(),
-            'active_tasks': len(self.active_tasks),
-            'completed_tasks': len(self.completed_tasks)
+            'nodes': nodes,
+            'queue': queue_status,
+            'active_tasks': active_tasks
         }
 
     # ... (resto de métodos anteriores: calculate_node_score, etc.) ...
 
     def register_node(self, node_id, energy_watts=100):
-        """Registra un nuevo nodo esclavo"""
-        self.energy_consumption[node_id] = energy_watts
-        self.performance_history[node_id] = {
-            "tasks_completed": 0,
-            "total_time": 0,
-            "avg_time": 0,
-            "failures": 0,
-            "success_rate": 1.0
-        }
-        print(f"✅ Nodo {node_id} registrado")
+        """Registra un nuevo nodo esclavo (si vuelve tras una expulsión conserva su historial)"""
+        with self._nodes_lock:
+            previous = self.energy_consumption.get(node_id)
+            self.energy_consumption[node_id] = energy_watts
+            history = self.performance_history.setdefault(node_id, {
+                "tasks_completed": 0,
+                "total_time": 0,
+                "avg_time": 0,
+                "failures": 0,
+                "success_rate": 1.0
+            })
 
-    def update_node_data(self, node_id, node_data):
-        """Actualiza los datos de un nodo esclavo"""
-        self.nodes_data[node_id] = node_data
-        if node_id not in self.energy_consumption:
-            self.register_node(node_id)
+            # Máximo de energía incremental: solo se recalcula si baja el nodo que lo marcaba
+            if self._max_energy is None or energy_watts >= self._max_energy:
+                self._max_energy = energy_watts
+            elif previous == self._max_energy:
+                self._max_energy = max(self.energy_consumption.values())
 
-    def calculate_node_score(self, node_id, node_data, system_load="normal"):
-        """Calcula puntuación del nodo"""
-        cpu_percent = node_data.get("cpu_percent", 100)
-        ram_percent = node_data.get("ram_percent", 100)
-        cpu_temp = node_data.get("cpu_temp", None)
+            self.metrics_table.set_energy(node_id, energy_watts)
+            self.metrics_table.set_success_rate(node_id, history["success_rate"])
+            self._refresh_node_score(node_id)
+            self._log({'op': 'register', 'node_id': node_id, 'energy_watts': energy_watts})
+            log.info("✅ Nodo %s registrado", node_id)
+
+    def update_node_data(self, node_id, node_data, timestamp=None, job_id=None):
+        """Actualiza los datos de un nodo esclavo y guarda la muestra en su serie temporal"""
+        with self._nodes_lock:
+            self.nodes_data[node_id] = node_data
+            self._free_resources[node_id] = node_resources(node_data)
+            self.last_seen[node_id] = self.clock()
+            if timestamp is None:
+                timestamp = self.last_seen[node_id]
+            if node_id not in self.energy_consumption:
+                self.register_node(node_id)
+            if self.scoring == "trend":
+                self.trends.update(node_id, timestamp, node_data)
+            self.metrics_table.upsert(
+                node_id, self._scoring_data(node_id),
+                energy=self.energy_consumption[node_id],
+                success_rate=self.performance_history[node_id]["success_rate"]
+            )
+            self._refresh_node_score(node_id)
+            self.metrics_series.record(
+                node_id, timestamp,
+                dict(node_data, power_watts=node_power(node_data, self.energy_consumption[node_id])),
+                job_id
+            )
 
-        if cpu_temp and cpu_temp > self.config["temp_max"]:
-            return 0.0
-        if ram_percent > self.config["ram_critical"]:
-            return 0.0
-        if cpu_percent > self.config["cpu_critical"]:
-            return 0.0
+    def _scoring_data(self, node_id):
+        """Métricas con las que se puntúa el nodo: la última muestra o, en modo trend, la previsión"""
+        node_data = self.nodes_data[node_id]
+        if self.scoring == "trend":
+            return dict(node_data, **self.trends.forecast(node_id, self.forecast_horizon))
+        return node_data
 
-        score_cpu = (100 - cpu_percent) / 100
-        score_ram = (100 - ram_percent) / 100
+    def update_nodes_bulk(self, updates):
+        """Aplica un lote de muestras [{node_id, campos...}] de una vez.
 
-        if cpu_temp is not None:
-            score_temp = max(0, (self.config["temp_max"] - cpu_temp) / self.config["temp_max"])
-        else:
-            score_temp = 0.5
+        Las muestras pueden ser deltas: los campos ausentes conservan su último valor.
+        """
+        applied = 0
+        with self._nodes_lock:
+            for update in updates:
+                node_id = update.get('node_id')
+                if not node_id:
+                    continue
+                node_data = dict(self.nodes_data.get(node_id) or dict.fromkeys(METRIC_FIELDS))
+                node_data.update({field: update[field] for field in METRIC_FIELDS if field in update})
+                self.update_node_data(node_id, node_data, update.get('timestamp'), update.get('job_id'))
+                applied += 1
+        return applied
 
-        node_energy = self.energy_consumption.get(node_id, 100)
-        max_energy = max(self.energy_consumption.values()) if self.energy_consumption else 100
-        score_energy = 1 - (node_energy / max_energy)
+    def get_max_energy(self):
+        """Consumo máximo entre los nodos registrados (100 si no hay ninguno)"""
+        return self._max_energy if self._max_energy is not None else 100
 
-        perf = self.performance_history.get(node_id, {"success_rate": 0.5})
-        score_history = perf["success_rate"]
+    def get_load_weights(self, system_load="normal"):
+        """Pesos ajustados a la carga y normalizados, cacheados por system_load"""
+        key = (system_load, tuple(self.weights.items()))
+        weights = self._weights_cache.get(key)
+        if weights is not None:
+            return weights
 
         weights = self.weights.copy()
-        if system_load == "low":
-            weights["energy_efficiency"] *= 1.5
-            weights["cpu_availability"] *= 0.7
-        elif system_load == "high":
-            weights["cpu_availability"] *= 1.3
-            weights["temperature"] *= 1.3
-            weights["energy_efficiency"] *= 0.5
+        for name, factor in self.load_multipliers.get(system_load, {}).items():
+            weights[name] *= factor
 
         total_weight = sum(weights.values())
         weights = {k: v / total_weight for k, v in weights.items()}
+        self._weights_cache[key] = weights
+        return weights
+
+    def calculate_all_scores(self, system_load="normal"):
+        """Calcula la puntuación de todos los nodos de una vez (vectorizado)"""
+        with self._nodes_lock:
+            if not len(self.metrics_table):
+                return {}
+            scores = self.metrics_table.scores(
+                self.get_load_weights(system_load), self.config, self.get_max_energy()
+            )
+            return dict(zip(self.metrics_table.node_ids, scores.tolist()))
+
+    def _current_index_key(self):
+        return tuple(self.weights.items()), self.get_max_energy()
+
+    def _ensure_score_index(self):
+        """Reconstruye el índice si cambiaron los pesos o el máximo de energía"""
+        key = self._current_index_key()
+        if key != self._index_key:
+            for system_load in NodeScoreIndex.LOADS:
+                self.score_index.rebuild(system_load, self.calculate_all_scores(system_load))
+            self._index_key = key
+
+    def _refresh_node_score(self, node_id):
+        """Recalcula en el índice solo las puntuaciones del nodo modificado"""
+        if node_id not in self.nodes_data:
+            return
+        if self._current_index_key() != self._index_key:
+            return  # Todas las puntuaciones cambian: se reconstruye en la próxima consulta
+        for system_load in NodeScoreIndex.LOADS:
+            score = self.calculate_node_score(node_id, self._scoring_data(node_id), system_load)
+            self.score_index.update(node_id, system_load, score)
+
+    def get_node_score(self, node_id, system_load="normal"):
+        """Puntuación indexada de un nodo sin recalcularla"""
+        with self._nodes_lock:
+            self._ensure_score_index()
+            score = self.score_index.get_score(node_id, system_load)
+            if score is None:
+                node_data = self._scoring_data(node_id) if node_id in self.nodes_data else {}
+                score = self.calculate_node_score(node_id, node_data, system_load)
+            return score
+
+    def get_all_scores(self, system_load="normal"):
+        """Puntuaciones indexadas de todos los nodos"""
+        with self._nodes_lock:
+            self._ensure_score_index()
+            return dict(self.score_index.get_scores(system_load))
+
+    def get_best_node(self, system_load="normal"):
+        """Mejor nodo según la puntuación, (None, 0) si no hay nodos.
 
-        final_score = (
-                score_cpu * weights["cpu_availability"] +
-                score_ram * weights["ram_availability"] +
-                score_temp * weights["temperature"] +
-                score_energy * weights["energy_efficiency"] +
-                score_history * weights["historical_performance"]
-        )
-        return final_score
+        En modo consolidate, si el clúster está con poca carga, es el nodo con sitio más
+        eficiente (ver get_packing_order); con placement="ect", el que terminaría antes la
+        próxima tarea de la cola (ver get_completion_order).
+        """
+        if self._consolidating() or self.placement == "ect":
+            top = self.get_top_nodes(system_load, 1)
+            if top:
+                return top[0]
+        with self._nodes_lock:
+            self._ensure_score_index()
+            return self.score_index.best(system_load)
 
-    def update_performance(self, node_id, task_time, success=True):
-        """Actualiza el historial de rendimiento"""
-        if node_id not in self.performance_history:
-            self.register_node(node_id)
+    def get_top_nodes(self, system_load="normal", k=3):
+        """Los k mejores nodos como lista de (node_id, score); al consolidar, en orden de llenado,
+        y con placement="ect", por tiempo esperado de la próxima tarea"""
+        if self._consolidating():
+            order = self.get_packing_order()[:k]
+            if order:
+                return [(node['node_id'], self.get_node_score(node['node_id'], system_load)) for node in order]
+        elif self.placement == "ect":
+            order = self.get_completion_order(k, system_load=system_load)
+            if order:
+                return [(node_id, self.get_node_score(node_id, system_load)) for node_id, _ in order]
+        with self._nodes_lock:
+            self._ensure_score_index()
+            return self.score_index.top(system_load, k)
 
-        perf = self.performance_history[node_id]
+    def get_completion_order(self, k=3, task=None, system_load="normal"):
+        """Los k nodos que terminarían antes la tarea (la próxima de la cola si no se da): [(node_id, s)].
 
-        if success:
-            perf["tasks_completed"] += 1
-            perf["total_time"] += task_time
-            perf["avg_time"] = perf["total_time"] / perf["tasks_completed"]
-        else:
-            perf["failures"] += 1
+        Solo cuentan los nodos no críticos en los que la tarea cabe ahora, que pueden
+        empezarla ya, así que el tiempo de finalización es su duración esperada. Se buscan
+        entre los max(k, config["ect_candidates"]) mejor puntuados del índice, O(k log N),
+        en lugar de recorrer todo el clúster en cada decisión.
+        """
+        if task is None:
+            with self._task_lock:
+                task = self.task_queue.peek()
+            if task is None:
+                return []
+        req, kind = task_requirements(task), task_type(task)
+        with self._nodes_lock:
+            self._ensure_score_index()
+            top = self.score_index.top(system_load, max(k, self.config["ect_candidates"]))
+            free = self._free_resources
+            candidates = [node_id for node_id, score in top
+                          if score != 0.0 and node_id in free and fits(req, free[node_id])]
+            expected = self.runtime_model.expected_many(candidates, kind)
+        return [(node_id, seconds) for seconds, node_id in heapq.nsmallest(k, zip(expected, candidates))]
 
-        total_tasks = perf["tasks_completed"] + perf["failures"]
-        perf["success_rate"] = perf["tasks_completed"] / total_tasks if total_tasks > 0 else 0.5
+    def get_system_load(self):
+        """Carga del clúster según la CPU media de los nodos: low, normal o high"""
+        with self._nodes_lock:
+            n = len(self.metrics_table)
+            mean_cpu = float(self.metrics_table.cpu[:n].mean()) if n else 0.0
+        if mean_cpu < self.config["low_load_cpu"]:
+            return "low"
+        return "high" if mean_cpu > self.config["high_load_cpu"] else "normal"
+
+    def _consolidating(self):
+        return self.consolidate and self.get_system_load() == "low"
+
+    def get_energy_profile(self):
+        """Potencia (la reportada o la registrada), julios por tarea, núcleos libres y estado de cada nodo"""
+        with self._task_lock:
+            active = Counter(info['node_id'] for info in self.active_tasks.values())
+        with self._nodes_lock:
+            self._ensure_score_index()
+            # Sin historial propio se supone la duración media del resto de nodos
+            known = [perf['avg_time'] for perf in self.performance_history.values() if perf['tasks_completed']]
+            default_time = sum(known) / len(known) if known else DEFAULT_TASK_SECONDS
+            profile = []
+            for node_id, data in self.nodes_data.items():
+                perf = self.performance_history[node_id]
+                power = node_power(data, self.energy_consumption[node_id])
+                cores = data.get("cpu_cores") or 1
+                cpu = data.get("cpu_percent")
+                cpu = 100 if cpu is None else cpu
+                profile.append({
+                    'node_id': node_id,
+                    'power_watts': power,
+                    'joules_per_task': joules_per_task(
+                        power, perf['avg_time'] if perf['tasks_completed'] else default_time, cores),
+                    'free_cores': max(0.0, cores * (self.config["pack_cpu_max"] - cpu) / 100),
+                    'active_tasks': active[node_id],
+                    'tasks_completed': perf['tasks_completed'],
+                    'idle': active[node_id] == 0 and cpu < self.config["idle_cpu"],
+                    'critical': self.score_index.get_score(node_id) == 0.0
+                })
+        return profile
+
+    def get_packing_order(self):
+        """Nodos no críticos con sitio, en el orden en que se llenan al consolidar"""
+        return packing_order([node for node in self.get_energy_profile()
+                              if node['free_cores'] > 0 and not node['critical']])
+
+    def get_parking_candidates(self):
+        """Nodos ociosos que no hacen falta para la cola pendiente (solo con consolidate y carga baja)"""
+        if not self._consolidating():
+            return []
+        order = packing_order([node for node in self.get_energy_profile() if not node['critical']])
+        return parking_candidates(order, demand=self.task_queue.qsize())
+
+    def is_parked(self, node_id):
+        """Si el nodo está entre los de get_parking_candidates(), sin recalcularlos en cada petición.
+
+        El conjunto depende de las métricas, la cola y las tareas activas, y calcularlo es
+        O(N log N) bajo el lock de nodos: se guarda y se recalcula cada PARKING_REFRESH segundos.
+        """
+        now = self.clock()
+        cached = self._parked
+        if cached is None or now >= cached[0]:
+            cached = self._parked = (now + PARKING_REFRESH, frozenset(self.get_parking_candidates()))
+        return node_id in cached[1]
+
+    def get_energy_report(self):
+        """Energía estimada de las tareas completadas frente a repartirlas por igual entre los nodos"""
+        profile = self.get_energy_profile()
+        parked = set(self.get_parking_candidates())
+        total_tasks = sum(node['tasks_completed'] for node in profile)
+        estimated = sum(node['tasks_completed'] * node['joules_per_task'] for node in profile)
+        mean_joules = sum(node['joules_per_task'] for node in profile) / len(profile) if profile else 0.0
+        spread = total_tasks * mean_joules
+        nodes = {}
+        for node in profile:
+            node = dict(node, parking_candidate=node['node_id'] in parked)
+            nodes[node.pop('node_id')] = node
+        return {
+            'consolidate': self.consolidate,
+            'system_load': self.get_system_load(),
+            'nodes': nodes,
+            'tasks_completed': total_tasks,
+            'estimated_joules': estimated,
+            'spread_evenly_joules': spread,
+            'saved_joules': spread - estimated,
+            'parking_candidates': sorted(parked),
+            'parking_watts': sum(node['power_watts'] for node in nodes.values() if node['parking_candidate'])
+        }
+
+    def calculate_node_score(self, node_id, node_data, system_load="normal"):
+        """Calcula puntuación del nodo"""
+        with self._score_latency.time():
+            # /update_metrics guarda None si falta el campo: se trata igual que el valor por defecto
+            cpu_percent = node_data.get("cpu_percent")
+            ram_percent = node_data.get("ram_percent")
+            cpu_percent = 100 if cpu_percent is None else cpu_percent
+            ram_percent = 100 if ram_percent is None else ram_percent
+            cpu_temp = node_data.get("cpu_temp", None)
+
+            if cpu_temp and cpu_temp > self.config["temp_max"]:
+                return 0.0
+            if ram_percent > self.config["ram_critical"]:
+                return 0.0
+            if cpu_percent > self.config["cpu_critical"]:
+                return 0.0
+
+            score_cpu = (100 - cpu_percent) / 100
+            score_ram = (100 - ram_percent) / 100
+
+            if cpu_temp is not None:
+                score_temp = max(0, (self.config["temp_max"] - cpu_temp) / self.config["temp_max"])
+            else:
+                score_temp = 0.5
+
+            node_energy = self.energy_consumption.get(node_id, 100)
+            score_energy = 1 - (node_energy / self.get_max_energy())
+
+            perf = self.performance_history.get(node_id, {"success_rate": 0.5})
+            score_history = perf["success_rate"]
+
+            weights = self.get_load_weights(system_load)
+
+            final_score = (
+                    score_cpu * weights["cpu_availability"] +
+                    score_ram * weights["ram_availability"] +
+                    score_temp * weights["temperature"] +
+                    score_energy * weights["energy_efficiency"] +
+                    score_history * weights["historical_performance"]
+            )
+            return final_score
+
+    def update_performance(self, node_id, task_time, success=True, kind=None):
+        """Actualiza el historial de rendimiento (y, con el tipo de tarea, su tiempo en runtime_model)"""
+        with self._nodes_lock:
+            if node_id not in self.performance_history:
+                self.register_node(node_id)
+
+            perf = self.performance_history[node_id]
+
+            if success:
+                perf["tasks_completed"] += 1
+                perf["total_time"] += task_time
+                perf["avg_time"] = perf["total_time"] / perf["tasks_completed"]
+                if kind is not None:
+                    self.runtime_model.record(node_id, kind, task_time)
+            else:
+                perf["failures"] += 1
+
+            total_tasks = perf["tasks_completed"] + perf["failures"]
+            perf["success_rate"] = perf["tasks_completed"] / total_tasks if total_tasks > 0 else 0.5
+            self.metrics_table.set_success_rate(node_id, perf["success_rate"])
+            self._refresh_node_score(node_id)
 
 
 # === SERVIDOR FLASK ===
 
 app = Flask(__name__)
 master = None
+profiler = None  # SamplingProfiler opcional (MASTER_PROFILE=intervalo en segundos)
 
+MAX_TASKS_PER_REQUEST = 64  # Tope de tareas por petición a /request_task
+MAX_WAIT_SECONDS = 30  # Tope del long-poll de /request_task
+MAX_COMPLETED_PAGE = 1000  # Tope de resultados por página de /completed_tasks
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
 
-@app.route('/register', methods=['POST'])
-def register_node():
-    data = request.get_json()
+# Latencia y respuestas de cada endpoint HTTP (las comparten agente.py y servidor_async.py)
+http_metrics = MetricsRegistry()
+http_latency = http_metrics.histogram("http_request_seconds", "Duración de las peticiones HTTP",
+                                      labelnames=("endpoint", "method"))
+http_responses = http_metrics.counter("http_responses_total", "Respuestas HTTP por código",
+                                      labelnames=("endpoint", "code"))
+
+
+def observe_request(rule, method, status_code, start):
+    endpoint = rule.rule if rule is not None else "sin_ruta"
+    http_latency.observe(time.perf_counter() - start, endpoint, method)
+    http_responses.inc(endpoint, str(status_code))
+
+
+# Lógica de los endpoints, compartida con el servidor asíncrono (servidor_async.py).
+# Cada función devuelve (cuerpo, código HTTP).
+
+def handle_register(master, data):
     node_id = data.get('node_id')
     energy_watts = data.get('energy_watts', 100)
 
     if not node_id:
-        return jsonify({"error": "node_id requerido"}), 400
+        return {"error": "node_id requerido"}, 400
 
     master.register_node(node_id, energy_watts)
-    return jsonify({"status": "registered", "node_id": node_id}), 200
+    return {"status": "registered", "node_id": node_id}, 200
 
 
-@app.route('/update_metrics', methods=['POST'])
-def update_metrics():
-    data = request.get_json()
-    node_id = data.get('node_id') or request.remote_addr
-
-    metrics = {
-        "cpu_cores": data.get("cpu_cores"),
-        "cpu_percent": data.get("cpu_percent"),
-        "ram_total_GB": data.get("ram_total_GB"),
-        "ram_percent": data.get("ram_percent"),
-        "cpu_temp": data.get("cpu_temp")
-    }
+def sample_error(sample):
+    """Mensaje de error si una muestra no es un objeto con métricas y timestamp numéricos, o None"""
+    if not isinstance(sample, dict):
+        return "cada muestra debe ser un objeto"
+    for field in METRIC_FIELDS:
+        value = sample.get(field)
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool)):
+            return f"{field} debe ser numérico"
+    timestamp = sample.get('timestamp')
+    if timestamp is not None and (not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool)
+                                  or not math.isfinite(timestamp)):
+        return "timestamp debe ser un número (epoch en segundos)"
+    # Fuera de rango rompería datetime.fromtimestamp al guardar la serie
+    if timestamp is not None and not 0 <= timestamp <= time.time() + MAX_CLOCK_SKEW:
+        return "timestamp fuera de rango (epoch en segundos, no más de un día en el futuro)"
+    return None
 
-    master.update_node_data(node_id, metrics)
-    return jsonify({"status": "updated", "node_id": node_id}), 200
 
+def handle_update_metrics(master, data, remote_addr):
+    node_id = data.get('node_id') or remote_addr
+
+    error = sample_error(data)
+    if error:
+        return {"error": error}, 400
+    metrics = {field: data.get(field) for field in METRIC_FIELDS}
+
+    master.update_node_data(node_id, metrics, data.get('timestamp'), data.get('job_id'))
+    return {"status": "updated", "node_id": node_id}, 200
 
-@app.route('/request_task', methods=['POST'])
-def request_task():
-    """Endpoint para que un esclavo pida una tarea"""
-    data = request.get_json()
-    node_id = data.get('node_id') or request.remote_addr
+
+def handle_update_metrics_bulk(master, data, remote_addr):
+    """Lote de muestras: {"updates": [{node_id, ...}]} o {"node_id": ..., "samples": [...]}"""
+    updates = data.get('updates')
+    if updates is None:
+        samples = data.get('samples') or []
+        if not isinstance(samples, list) or not all(isinstance(sample, dict) for sample in samples):
+            return {"error": "samples debe ser una lista de objetos"}, 400
+        node_id = data.get('node_id') or remote_addr
+        updates = [dict(sample, node_id=sample.get('node_id') or node_id) for sample in samples]
+    if not isinstance(updates, list):
+        return {"error": "updates o samples (lista) requeridos"}, 400
+    error = next((error for error in map(sample_error, updates) if error), None)
+    if error:
+        return {"error": error}, 400
+
+    applied = master.update_nodes_bulk(updates)
+    return {"status": "updated", "applied": applied}, 200
+
+
+def handle_request_task(master, data, remote_addr):
+    node_id = data.get('node_id') or remote_addr
 
     # Verificar que el nodo esté en buen estado
     if node_id in master.nodes_data:
-        score = master.calculate_node_score(node_id, master.nodes_data[node_id])
+        score = master.get_node_score(node_id)
         if score < 0.3:  # Umbral mínimo
-            return jsonify({
+            return {
                 "status": "rejected",
                 "reason": "Node score too low",
                 "score": score
-            }), 200
+            }, 200
+
+    # Modo consolidación con poca carga: los nodos ociosos que sobran no reciben trabajo
+    if master.consolidate and master.is_parked(node_id):
+        return {
+            "status": "parked",
+            "reason": "Idle node not needed at low load"
+        }, 200
+
+    # Long-poll: esperar hasta 'wait' segundos a que llegue una tarea
+    try:
+        wait = min(max(0.0, float(data.get('wait', 0))), MAX_WAIT_SECONDS)
+    except (TypeError, ValueError):
+        return {"error": "wait debe ser un número de segundos"}, 400
+
+    # Lote de tareas: max_tasks numérico o "auto" (según los núcleos del nodo)
+    max_tasks = data.get('max_tasks')
+    if max_tasks is not None:
+        if max_tasks == "auto":
+            max_tasks = master.get_node_capacity(node_id)
+        try:
+            max_tasks = min(max(1, int(max_tasks)), MAX_TASKS_PER_REQUEST)
+        except (TypeError, ValueError):
+            return {"error": "max_tasks debe ser un entero o 'auto'"}, 400
+
+        tasks = master.get_next_tasks_for_node(node_id, max_tasks, timeout=wait)
+        if tasks:
+            return {
+                "status": "tasks_assigned",
+                "tasks": tasks
+            }, 200
+        return {
+            "status": "no_tasks",
+            "message": "No hay tareas pendientes"
+        }, 200
 
     # Obtener siguiente tarea
-    task = master.get_next_task_for_node(node_id)
+    task = master.get_next_task_for_node(node_id, timeout=wait)
 
     if task:
-        return jsonify({
+        return {
             "status": "task_assigned",
             "task": task
-        }), 200
+        }, 200
     else:
-        return jsonify({
+        return {
             "status": "no_tasks",
             "message": "No hay tareas pendientes"
-        }), 200
+        }, 200
 
 
-@app.route('/complete_task', methods=['POST'])
-def complete_task():
-    """Endpoint para reportar tarea completada"""
-    data = request.get_json()
-    task_id = data.get('task_id')
+def handle_complete_task(master, data):
     node_id = data.get('node_id')
+
+    results = data.get('results')
+    if results is not None:
+        if not node_id or not isinstance(results, list):
+            return {"error": "node_id y results (lista) requeridos"}, 400
+        # Se valida el lote entero antes de cerrar ningún lease
+        if not all(isinstance(item, dict) and item.get('task_id') is not None for item in results):
+            return {"error": "cada resultado debe ser un objeto con task_id"}, 400
+        completed, not_found = master.complete_tasks(node_id, results)
+        return {
+            "status": "completed",
+            "completed": completed,
+            "not_found": not_found
+        }, 200
+
+    task_id = data.get('task_id')
     result = data.get('result')
     success = data.get('success', True)
 
     if not task_id or not node_id:
-        return jsonify({"error": "task_id y node_id requeridos"}), 400
+        return {"error": "task_id y node_id requeridos"}, 400
 
     if master.complete_task(task_id, node_id, result, success):
-        return jsonify({"status": "completed"}), 200
+        return {"status": "completed"}, 200
     else:
-        return jsonify({"error": "Task not found"}), 404
+        return {"error": "Task not found"}, 404
 
 
-@app.route('/add_task', methods=['POST'])
-def add_task():
-    """Endpoint para añadir tareas a la cola (para testing o cliente externo)"""
-    data = request.get_json()
+def handle_add_task(master, data):
     task_data = data.get('task_data')
 
     if not task_data:
-        return jsonify({"error": "task_data requerido"}), 400
+        return {"error": "task_data requerido"}, 400
+
+    # Opcionales: priority (mayor = antes) y requirements {cores, ram_GB, max_temp}
+    if isinstance(task_data, dict):
+        requirements = task_data.get('requirements') or {}
+        values = [task_data.get('priority', 0)] + list(requirements.values()) \
+            if isinstance(requirements, dict) else None
+        if values is None or not all(isinstance(v, (int, float)) and not isinstance(v, bool)
+                                     for v in values if v is not None):
+            return {"error": "priority y requirements (cores, ram_GB, max_temp) deben ser numéricos"}, 400
+        if 'priority' in task_data and task_data['priority'] is None:
+            return {"error": "priority no puede ser null (se omite para la prioridad 0)"}, 400
 
     task_id = master.add_task(task_data)
-    return jsonify({"status": "task_added", "task_id": task_id}), 200
+    return {"status": "task_added", "task_id": task_id}, 200
+
+
+def handle_completed_tasks(master, args):
+    """Consulta paginada del historial: node_id, since, until, success, offset, limit"""
+    success = args.get('success')
+    if success is not None:
+        success = success.lower() in ("1", "true", "yes")
+    try:
+        offset = max(0, int(args.get('offset', 0)))
+        limit = min(max(1, int(args.get('limit', 100))), MAX_COMPLETED_PAGE)
+    except ValueError:
+        return {"error": "offset y limit deben ser enteros"}, 400
+
+    tasks = master.completed_tasks.query(
+        node_id=args.get('node_id'), since=args.get('since'), until=args.get('until'),
+        success=success, offset=offset, limit=limit
+    )
+    return {"tasks": tasks, "offset": offset, "limit": limit, "total": len(master.completed_tasks)}, 200
+
+
+def _parse_time(value):
+    """Epoch en segundos o fecha ISO; ValueError si no es ninguna de las dos o no es una fecha válida"""
+    if value is None:
+        return None
+    try:
+        timestamp = float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+    try:
+        datetime.fromtimestamp(timestamp)  # NaN, infinito o años fuera de rango
+    except (ValueError, OverflowError, OSError):
+        raise ValueError(f"Fecha fuera de rango: {value}")
+    return timestamp
+
+
+def handle_metrics_history(master, args):
+    """Serie temporal de un nodo: node_id, since, until (epoch o ISO), resolution (raw, 1m, 1h)"""
+    node_id = args.get('node_id')
+    if not node_id:
+        return {"error": "node_id requerido"}, 400
+    resolution = args.get('resolution', 'raw')
+    if resolution != 'raw' and resolution not in ROLLUPS:
+        return {"error": f"resolution debe ser raw o {', '.join(ROLLUPS)}"}, 400
+    try:
+        since, until = _parse_time(args.get('since')), _parse_time(args.get('until'))
+    except ValueError:
+        return {"error": "since y until deben ser epoch en segundos o fechas ISO"}, 400
+
+    series = master.metrics_series.query(node_id, since, until, resolution)
+    if series is None:
+        return {"error": "Nodo sin métricas"}, 404
+    return series, 200
+
+
+def handle_energy_report(master):
+    report = master.get_energy_report()
+    report['timestamp'] = datetime.now().isoformat()
+    return report, 200
+
+
+def handle_runtime_stats(master):
+    with master._nodes_lock:
+        stats = master.runtime_model.summary()
+    stats['placement'] = master.placement
+    stats['timestamp'] = datetime.now().isoformat()
+    return stats, 200
+
+
+def handle_prometheus_metrics(master):
+    """Métricas del maestro y de los endpoints en formato de texto de Prometheus"""
+    return master.metrics.render() + http_metrics.render(), 200
+
+
+def handle_profile(profiler, args):
+    """Pilas muestreadas en formato collapsed (flamegraph.pl); top=N las N más frecuentes, reset=1 vacía"""
+    if profiler is None:
+        return "Perfilador desactivado (MASTER_PROFILE o --profile)\n", 404
+    try:
+        top = int(args['top']) if args.get('top') else None
+    except ValueError:
+        return "top debe ser un entero\n", 400
+    body = profiler.collapsed(top)
+    if args.get('reset') in ("1", "true", "yes"):
+        profiler.reset()
+    return body, 200
+
+
+def handle_status(master):
+    status = master.get_status_snapshot()
+    status['timestamp'] = datetime.now().isoformat()
+    return status, 200
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request_latency(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        observe_request(request.url_rule, request.method, response.status_code, start)
+    return response
+
+
+@app.route('/register', methods=['POST'])
+def register_node():
+    body, code = handle_register(master, request.get_json())
+    return jsonify(body), code
+
+
+@app.route('/update_metrics', methods=['POST'])
+def update_metrics():
+    body, code = handle_update_metrics(master, request.get_json(), request.remote_addr)
+    return jsonify(body), code
+
+
+@app.route('/update_metrics_bulk', methods=['POST'])
+def update_metrics_bulk():
+    """Endpoint para ingerir de una vez un lote de métricas (posiblemente deltas)"""
+    body, code = handle_update_metrics_bulk(master, request.get_json(), request.remote_addr)
+    return jsonify(body), code
+
+
+@app.route('/request_task', methods=['POST'])
+def request_task():
+    """Endpoint para que un esclavo pida una tarea"""
+    body, code = handle_request_task(master, request.get_json(), request.remote_addr)
+    return jsonify(body), code
+
+
+@app.route('/complete_task', methods=['POST'])
+def complete_task():
+    """Endpoint para reportar tarea completada (o un lote en 'results')"""
+    body, code = handle_complete_task(master, request.get_json())
+    return jsonify(body), code
+
+
+@app.route('/add_task', methods=['POST'])
+def add_task():
+    """Endpoint para añadir tareas a la cola (para testing o cliente externo)"""
+    body, code = handle_add_task(master, request.get_json())
+    return jsonify(body), code
 
 
 @app.route('/queue_status', methods=['GET'])
@@ -285,16 +1356,53 @@ def queue_status():
     return jsonify(master.get_queue_status()), 200
 
 
+@app.route('/completed_tasks', methods=['GET'])
+def completed_tasks():
+    """Endpoint para consultar el historial de tareas completadas"""
+    body, code = handle_completed_tasks(master, request.args)
+    return jsonify(body), code
+
+
+@app.route('/metrics_history', methods=['GET'])
+def metrics_history():
+    """Endpoint para consultar la serie temporal de métricas de un nodo"""
+    body, code = handle_metrics_history(master, request.args)
+    return jsonify(body), code
+
+
+@app.route('/energy_report', methods=['GET'])
+def energy_report():
+    """Energía estimada frente a repartir por igual y nodos candidatos a aparcarse"""
+    body, code = handle_energy_report(master)
+    return jsonify(body), code
+
+
+@app.route('/runtime_stats', methods=['GET'])
+def runtime_stats():
+    """Tiempos de ejecución por nodo y tipo de tarea (media, desviación y cuantiles)"""
+    body, code = handle_runtime_stats(master)
+    return jsonify(body), code
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Latencias, contadores y gauges en formato Prometheus"""
+    body, code = handle_prometheus_metrics(master)
+    return Response(body, status=code, content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """Pilas del perfilador por muestreo (si está activo)"""
+    body, code = handle_profile(profiler, request.args)
+    return Response(body, status=code, mimetype="text/plain")
+
+
 @app.route('/status', methods=['GET'])
 def get_status():
     """Estado completo del clúster"""
-    status = {
-        'nodes': master.nodes_data,
-        'queue': master.get_queue_status(),
-        'active_tasks': master.active_tasks,
-        'timestamp': datetime.now().isoformat()
-    }
-    return jsonify(status), 200
+    body, code = handle_status(master)
+    return jsonify(body), code
 
 
 if __name__ == "__main__":
@@ -306,18 +1414,35 @@ if __name__ == "__main__":
         "historical_performance": 0.05
     }
 
-    master = MasterAgent(weights=custom_weights)
+    configure_logging()
+    if os.environ.get("MASTER_PROFILE"):
+        profiler = SamplingProfiler(float(os.environ["MASTER_PROFILE"]))
+        profiler.start()
+
+    weights = WEIGHTS_PROFILE if os.path.exists(WEIGHTS_PROFILE) else custom_weights
+    master = MasterAgent(weights=weights, completed_db='tareas_completadas.db',
+                         metrics_db='metricas_cluster.db')
+    master.start_reaper()
 
     # Añadir algunas tareas de ejemplo
-    master.add_task({"type": "train_model", "epochs": 10})
+    master.add_task({"type": "train_model", "epochs": 10, "priority": 1,
+                     "requirements": {"cores": 2, "ram_GB": 4, "max_temp": 75}})
     master.add_task({"type": "process_data", "file": "data1.csv"})
     master.add_task({"type": "simulation", "params": {"x": 100}})
 
     print("\n🚀 Servidor maestro con cola de tareas iniciado")
     print("📡 Endpoints:")
-    print("   - POST /request_task    : Pedir tarea")
-    print("   - POST /complete_task   : Reportar tarea completada")
+    print("   - POST /request_task    : Pedir tarea (o varias con max_tasks=N|auto, wait=s para long-poll)")
+    print("   - POST /complete_task   : Reportar tarea(s) completada(s)")
     print("   - POST /add_task        : Añadir tarea a la cola")
-    print("   - GET  /queue_status    : Ver estado de la cola\n")
+    print("   - GET  /queue_status    : Ver estado de la cola")
+    print("   - GET  /metrics_history : Serie de métricas de un nodo (raw, 1m, 1h)")
+    print("   - GET  /energy_report   : Energía estimada y nodos candidatos a aparcarse")
+    print("   - GET  /runtime_stats   : Tiempos de ejecución por nodo y tipo de tarea")
+    print("   - GET  /metrics         : Latencias y contadores en formato Prometheus\n")
 
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    try:
+        app.run(host='0.0.0.0', port=5000, debug=False)
+    finally:
+        master.stop_reaper()
+        master.close()  # Vacía a disco las tareas completadas y las métricas pendientes
@@ -1,72 +1,156 @@
 from flask import request, jsonify
 from datetime import datetime  # ✅ CORREGIDO
+import json
+import logging
+import os
 import requests
-from agente import MasterAgent, app
+import agente
+from agente import MasterAgent, WEIGHTS_PROFILE, app
+from asesor_ollama import OllamaAdvisor, quantize_cluster_state
+from instrumentacion import configure_logging
+
+log = logging.getLogger("agente_ollama")
 
 # ✅ Definir master como global
 master = None
 
 
 class MasterAgentWithOllama(MasterAgent):
-    def __init__(self, weights=None, use_ollama=True, ollama_model='llama2'):
-        super().__init__(weights)
+    def __init__(self, weights=None, use_ollama=True, ollama_model='llama2',
+                 ollama_deadline=0.5, cache_ttl=60, cache_size=256,
+                 prompt_mode='full', prompt_top_k=5, ollama_stream=True, **kwargs):
+        super().__init__(weights, **kwargs)
         self.use_ollama = use_ollama
         self.ollama_model = ollama_model
         self.ollama_url = 'http://localhost:11434/api/generate'
 
-    def query_ollama(self, prompt):
-        """Consulta al modelo LLM local de Ollama"""
-        try:
-            payload = {
-                'model': self.ollama_model,
-                'prompt': prompt,
-                'stream': False
-            }
-            response = requests.post(self.ollama_url, json=payload, timeout=30)
-            if response.status_code == 200:
-                return response.json().get('response', '')
-            else:
-                print(f"⚠️ Error en Ollama: {response.status_code}")
+        # 'full': bloque Markdown por nodo; 'compact': tabla con los prompt_top_k mejores por puntuación
+        self.prompt_mode = prompt_mode
+        self.prompt_top_k = prompt_top_k
+        self.ollama_stream = ollama_stream
+
+        # Consultas en segundo plano: si el LLM no responde en ollama_deadline
+        # segundos se usa la puntuación y su respuesta queda cacheada para después
+        self.advisor = OllamaAdvisor(deadline=ollama_deadline, ttl=cache_ttl, max_entries=cache_size)
+
+        self._ollama_latency = self.metrics.histogram("ollama_query_seconds", "Duración de query_ollama")
+        self._ollama_errors = self.metrics.counter("ollama_errors_total", "Consultas a Ollama fallidas")
+
+    def query_ollama(self, prompt, stop=None):
+        """Consulta al modelo LLM local de Ollama.
+
+        En modo streaming deja de leer en cuanto stop(texto_recibido) devuelve True.
+        """
+        with self._ollama_latency.time():
+            try:
+                payload = {
+                    'model': self.ollama_model,
+                    'prompt': prompt,
+                    'stream': self.ollama_stream
+                }
+                # El with cierra la conexión en todos los casos, también si la respuesta es un error
+                with requests.post(self.ollama_url, json=payload, timeout=30, stream=self.ollama_stream) as response:
+                    if response.status_code != 200:
+                        log.warning("⚠️ Error en Ollama: %s", response.status_code)
+                        self._ollama_errors.inc()
+                        return None
+                    if not self.ollama_stream:
+                        return response.json().get('response', '')
+
+                    # Streaming: una línea JSON por fragmento {"response": "...", "done": false}
+                    text = ''
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        text += chunk.get('response', '')
+                        if chunk.get('done') or (stop and stop(text)):
+                            break
+                    return text
+            except Exception as e:
+                log.error("❌ No se pudo conectar a Ollama: %s", e)
+                self._ollama_errors.inc()
                 return None
-        except Exception as e:
-            print(f"❌ No se pudo conectar a Ollama: {e}")
-            return None
 
     def select_best_node_with_ollama(self, system_load="normal"):
         """Selecciona el mejor nodo usando Ollama + sistema de ponderaciones"""
 
-        # 1. Calcular scores tradicionales primero
-        scores_detail = {}
-        for node_id, data in self.nodes_data.items():
-            score = self.calculate_node_score(node_id, data, system_load)
-            scores_detail[node_id] = score
+        # 1. Scores tradicionales, mantenidos en el índice de puntuaciones
+        scores_detail = self.get_all_scores(system_load)
 
         # 2. Si Ollama está habilitado, consultarlo
-        if self.use_ollama and self.nodes_data:
-            # Preparar prompt con información de los nodos
-            prompt = self._build_ollama_prompt(scores_detail, system_load)
-
-            ollama_response = self.query_ollama(prompt)
+        nodes = self.get_nodes_snapshot()
+        if self.use_ollama and nodes:
+            # Situaciones parecidas (mismos tramos de CPU/RAM/temperatura) comparten recomendación
+            key = quantize_cluster_state(nodes, system_load)
+            advice = self.advisor.advise(key, lambda: self._ask_ollama(scores_detail, system_load, nodes))
 
-            if ollama_response:
-                # Intentar extraer la recomendación de Ollama
-                recommended_node = self._parse_ollama_response(ollama_response)
+            if advice:
+                recommended_node, ollama_response = advice
 
-                if recommended_node and recommended_node in self.nodes_data:
-                    print(f"🤖 Ollama recomienda: {recommended_node}")
-                    print(f"   Razón: {ollama_response[:200]}...")
+                if recommended_node in scores_detail:
+                    log.info("🤖 Ollama recomienda: %s. Razón: %s...", recommended_node, ollama_response[:200])
 
                     return recommended_node, scores_detail[recommended_node], scores_detail
 
         # 3. Fallback: usar el mejor score tradicional
-        if scores_detail:  # ✅ Verificar que no esté vacío
-            best_node = max(scores_detail, key=scores_detail.get)
-            return best_node, scores_detail[best_node], scores_detail
+        best_node, best_score = self.get_best_node(system_load)
+        if best_node is not None:  # ✅ Verificar que no esté vacío
+            return best_node, best_score, scores_detail
         else:
             return None, 0, {}
 
-    def _build_ollama_prompt(self, scores_detail, system_load):
+    def _ask_ollama(self, scores_detail, system_load, nodes):
+        """Consulta completa al LLM: devuelve (nodo recomendado, respuesta) o None"""
+        # Preparar prompt con información de los nodos
+        if self.prompt_mode == 'compact':
+            nodes = self._prompt_candidates(system_load, nodes)
+            prompt = self._build_compact_prompt(scores_detail, system_load, nodes)
+        else:
+            prompt = self._build_ollama_prompt(scores_detail, system_load, nodes)
+
+        # Basta con la primera línea: en cuanto nombra un nodo se deja de leer
+        def first_line_names_node(text):
+            return '\n' in text.lstrip() and self._parse_ollama_response(text, nodes) is not None
+
+        ollama_response = self.query_ollama(prompt, stop=first_line_names_node)
+
+        if ollama_response:
+            # Intentar extraer la recomendación de Ollama
+            recommended_node = self._parse_ollama_response(ollama_response, nodes)
+            if recommended_node:
+                return recommended_node, ollama_response
+        return None
+
+    def _prompt_candidates(self, system_load, nodes):
+        """Los prompt_top_k mejores nodos por puntuación que siguen en el snapshot"""
+        top = self.get_top_nodes(system_load, self.prompt_top_k)
+        return {node_id: nodes[node_id] for node_id, _ in top if node_id in nodes}
+
+    def _build_compact_prompt(self, scores_detail, system_load, nodes):
+        """Prompt compacto: una fila por candidato en una tabla separada por '|'"""
+        rows = []
+        for node_id, data in nodes.items():
+            perf = self.performance_history.get(node_id, {})
+            temp = data.get('cpu_temp')
+            rows.append(
+                f"{node_id}|{data.get('cpu_percent') or 0:.0f}|{data.get('cpu_cores') or 0}"
+                f"|{data.get('ram_percent') or 0:.0f}|{data.get('ram_total_GB') or 0}"
+                f"|{'-' if temp is None else f'{temp:.0f}'}|{self.energy_consumption.get(node_id, 100)}"
+                f"|{perf.get('success_rate', 0.5) * 100:.0f}|{scores_detail.get(node_id, 0):.3f}"
+            )
+
+        return (
+            f"Elige el MEJOR nodo del clúster para una tarea. Carga del sistema: {system_load}.\n"
+            "nodo|cpu%|núcleos|ram%|ramGB|tempC|W|éxito%|score\n"
+            + "\n".join(rows) +
+            "\nResponde SOLO con el nombre del nodo en la primera línea y el motivo en la segunda.\n"
+        )
+
+    def _build_ollama_prompt(self, scores_detail, system_load, nodes=None):
         """Construye el prompt para Ollama con los datos de los nodos"""
+        if nodes is None:
+            nodes = self.get_nodes_snapshot()
 
         prompt = f"""Eres un experto en gestión de clústeres de computación. 
 Necesito que selecciones el MEJOR nodo para ejecutar una tarea.
@@ -77,7 +161,7 @@ Necesito que selecciones el MEJOR nodo para ejecutar una tarea.
 
 """
 
-        for node_id, data in self.nodes_data.items():
+        for node_id, data in nodes.items():
             score = scores_detail.get(node_id, 0)
             perf = self.performance_history.get(node_id, {})
 
@@ -103,16 +187,18 @@ Tu respuesta:"""
 
         return prompt
 
-    def _parse_ollama_response(self, response):
+    def _parse_ollama_response(self, response, nodes=None):
         """Extrae el nodo recomendado de la respuesta de Ollama"""
+        if nodes is None:
+            nodes = self.get_nodes_snapshot()
         # Buscar el nombre del nodo en la primera línea
         lines = response.strip().split('\n')
         if lines:
             first_line = lines[0].strip().lower()
-            # Buscar coincidencias con los nodos conocidos
-            for node_id in self.nodes_data.keys():
-                if node_id.lower() in first_line:
-                    return node_id
+            # Buscar coincidencias con los nodos conocidos (la más larga: node_10 antes que node_1)
+            matches = [node_id for node_id in nodes.keys() if node_id.lower() in first_line]
+            if matches:
+                return max(matches, key=len)
         return None
 
 
@@ -133,7 +219,7 @@ def request_task_ollama():
 
     # Verificar estado del nodo
     if node_id in master.nodes_data:
-        score = master.calculate_node_score(node_id, master.nodes_data[node_id])
+        score = master.get_node_score(node_id)
         if score < 0.3:
             return jsonify({
                 "status": "rejected",
@@ -191,12 +277,20 @@ if __name__ == "__main__":
         "historical_performance": 0.05
     }
 
+    configure_logging()
+
     # ✅ Asignar a la variable global
     master = MasterAgentWithOllama(
-        weights=custom_weights,
+        weights=WEIGHTS_PROFILE if os.path.exists(WEIGHTS_PROFILE) else custom_weights,
         use_ollama=True,
-        ollama_model='llama2'
+        ollama_model='llama2',
+        prompt_mode='compact',
+        prompt_top_k=5,
+        completed_db='tareas_completadas.db',
+        metrics_db='metricas_cluster.db'
     )
+    agente.master = master  # Los endpoints de agente.py (/request_task, /metrics...) usan el mismo maestro
+    master.start_reaper()
 
     # Añadir tareas de ejemplo
     master.add_task({"type": "train_model", "epochs": 10})
@@ -208,4 +302,8 @@ if __name__ == "__main__":
     print("   - POST /request_task_ollama    : Pedir tarea (versión Ollama)")
     print("   - GET  /get_best_node_ollama   : Consultar mejor nodo con IA\n")
 
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    try:
+        app.run(host='0.0.0.0', port=5000, debug=False)
+    finally:
+        master.stop_reaper()
+        master.close()
@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from agente import LOAD_MULTIPLIERS, MasterAgent, WEIGHTS_PROFILE
+from puntuacion import WEIGHT_KEYS, score_components
+from simulador import METRICAS_SQL, simulate, synthetic_trace, trace_from_cluster_metrics
+
+# === AJUSTE AUTOMÁTICO DE PESOS ===
+# Busca los pesos de la puntuación que minimizan makespan y energía sobre una traza.
+# 1) Criba vectorizada: miles de juegos de pesos puntúan a la vez todo el histórico de
+#    métricas (instantes x nodos x componentes) y se estima el coste de sus elecciones.
+# 2) Los mejores de la criba se simulan completos con simulador.py.
+# Las dos fases se reparten en un pool de procesos.
+
+_worker = {}  # Estado de cada proceso del pool (traza e histórico), creado por _init_worker
+
+
+def history_arrays(trace):
+    """Histórico de la traza como arrays instantes x nodos (cpu, ram, temp, power), rellenando hacia delante"""
+    node_ids = [spec.node_id for spec in trace.nodes]
+    times = sorted({sample[0] for samples in trace.background.values() for sample in samples})
+    position = {t: i for i, t in enumerate(times)}
+    columns = np.full((4, len(times), len(node_ids)), np.nan)
+    for j, node_id in enumerate(node_ids):
+        for t, cpu, ram, temp, power in trace.background[node_id]:
+            columns[:, position[t], j] = [cpu, ram, np.nan if temp is None else temp, power]
+        for i in range(1, len(times)):
+            missing = np.isnan(columns[:, i, j]) & ~np.isnan(columns[:, i - 1, j])
+            columns[missing, i, j] = columns[missing, i - 1, j]
+    cpu, ram, temp, power = columns
+    return {
+        "cpu": np.nan_to_num(cpu, nan=100.0), "ram": np.nan_to_num(ram, nan=100.0),
+        "temp": temp, "power": np.nan_to_num(power),
+        "energy": np.array([spec.watts for spec in trace.nodes], dtype=float),
+        "speed": np.array([spec.speed for spec in trace.nodes], dtype=float)
+    }
+
+
+def normalized_weights(candidates, system_load, load_multipliers):
+    """Pesos (candidatos x componentes) con los multiplicadores de system_load y normalizados"""
+    factors = load_multipliers.get(system_load, {})
+    weights = candidates * np.array([factors.get(key, 1.0) for key in WEIGHT_KEYS])
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def surrogate_costs(candidates, history, system_load="normal", load_multipliers=LOAD_MULTIPLIERS,
+                    config=None, max_cells=4_000_000):
+    """Duración y energía estimadas eligiendo, en cada instante, el mejor nodo de cada candidato.
+
+    La tarea que se asigna en el instante s dura (1 + cpu en s+1) / velocidad y consume
+    la potencia del nodo en s+1 durante ese tiempo. No modela la saturación de los nodos
+    (de eso se encarga la simulación completa). Devuelve (duración media, energía media)
+    por candidato.
+    """
+    config = config or MasterAgent().config
+    cpu, ram, temp = history["cpu"], history["ram"], history["temp"]
+    steps, n_nodes = cpu.shape
+    components, critical = score_components(
+        cpu[:-1], ram[:-1], temp[:-1], history["energy"], np.ones(n_nodes), config, history["energy"].max()
+    )
+    runtime = (1 + cpu[1:] / 100) / history["speed"]
+    energy = history["power"][1:] * runtime
+
+    weights = normalized_weights(candidates, system_load, load_multipliers)
+    durations, energies = np.empty(len(weights)), np.empty(len(weights))
+    chunk = max(1, max_cells // ((steps - 1) * n_nodes))
+    rows = np.arange(steps - 1)
+    for start in range(0, len(weights), chunk):
+        scores = np.einsum("snf,cf->csn", components, weights[start:start + chunk])
+        scores[:, critical] = 0.0
+        choice = scores.argmax(axis=2)  # (candidatos, instantes)
+        durations[start:start + chunk] = runtime[rows, choice].mean(axis=1)
+        energies[start:start + chunk] = energy[rows, choice].mean(axis=1)
+    return durations, energies
+
+
+def random_candidates(n, base, rng, concentration=2.0):
+    """El juego base más n-1 juegos de pesos al azar (Dirichlet) que suman 1"""
+    base = np.array([base[key] for key in WEIGHT_KEYS], dtype=float)
+    candidates = rng.dirichlet(np.full(len(WEIGHT_KEYS), concentration), size=n)
+    candidates[0] = base / base.sum()
+    return candidates
+
+
+def _init_worker(trace_spec):
+    kind, args = trace_spec
+    trace = synthetic_trace(*args) if kind == "synthetic" else trace_from_cluster_metrics(*args)
+    _worker["trace"] = trace
+    _worker["history"] = history_arrays(trace)
+
+
+def _screen(args):
+    candidates, system_load, load_multipliers = args
+    return surrogate_costs(candidates, _worker["history"], system_load, load_multipliers)
+
+
+def _simulate(args):
+    weights, system_load, load_multipliers = args
+    return simulate(_worker["trace"], weights=weights, system_load=system_load, load_multipliers=load_multipliers)
+
+
+def tune(trace_spec=("cluster_metrics", (METRICAS_SQL, 2000)), n_candidates=20000, top_k=32,
+         system_load="normal", energy_weight=0.5, load_multipliers=LOAD_MULTIPLIERS, workers=None, seed=0):
+    """Busca los pesos con menor makespan + energy_weight * energía (relativos a los pesos por defecto).
+
+    trace_spec: ("cluster_metrics", (ruta, n_tareas)) o ("synthetic", (nodos, tareas)); cada
+    proceso reconstruye la traza a partir de él. Devuelve el perfil con los mejores pesos.
+    """
+    rng = np.random.default_rng(seed)
+    default_weights = MasterAgent().weights
+    candidates = random_candidates(n_candidates, default_weights, rng)
+    workers = workers or os.cpu_count()
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(trace_spec,)) as pool:
+        chunks = np.array_split(candidates, workers)
+        screened = list(pool.map(_screen, [(chunk, system_load, load_multipliers) for chunk in chunks]))
+        durations = np.concatenate([d for d, _ in screened])
+        energies = np.concatenate([e for _, e in screened])
+        # Coste relativo al juego por defecto (candidato 0)
+        costs = durations / durations[0] + energy_weight * energies / energies[0]
+        # La criba no ve la saturación: la mitad de los finalistas son los mejores de la criba
+        # y la otra mitad se elige al azar entre el resto para no depender solo de ella
+        ranked = [int(i) for i in np.argsort(costs) if i != 0]
+        best_screened = ranked[:(top_k + 1) // 2]
+        explored = rng.choice(ranked[len(best_screened):], size=min(top_k // 2, len(ranked) - len(best_screened)),
+                              replace=False).tolist()
+        finalists = [0] + best_screened + explored
+
+        finalist_weights = [dict(zip(WEIGHT_KEYS, candidates[i].round(4).tolist())) for i in finalists]
+        results = list(pool.map(_simulate, [(weights, system_load, load_multipliers)
+                                            for weights in finalist_weights]))
+
+    baseline = results[0]
+
+    def objective(result):
+        return (result["makespan_h"] / baseline["makespan_h"] +
+                energy_weight * result["energy_trace_kWh"] / baseline["energy_trace_kWh"])
+
+    print(f"\n📊 Ajuste de pesos: {n_candidates} candidatos en la criba, {len(finalists)} simulados "
+          f"(system_load={system_load}, peso de la energía {energy_weight})")
+    for i, (weights, result) in enumerate(zip(finalist_weights, results)):
+        label = "por defecto" if i == 0 else f"criba {i}" if i <= len(best_screened) else f"azar {i}"
+        print(f"   {label:<12} objetivo {objective(result):.3f} | makespan {result['makespan_h']:6.1f}h | "
+              f"{result['energy_trace_kWh']:7.1f} kWh | criba {costs[finalists[i]]:.3f}")
+
+    best = min(range(len(results)), key=lambda i: objective(results[i]))
+    return {
+        "weights": finalist_weights[best],
+        "load_multipliers": load_multipliers,
+        "system_load": system_load,
+        "objective": {
+            "energy_weight": energy_weight,
+            "value": objective(results[best]),
+            "makespan_h": results[best]["makespan_h"],
+            "energy_trace_kWh": results[best]["energy_trace_kWh"],
+            "baseline_makespan_h": baseline["makespan_h"],
+            "baseline_energy_trace_kWh": baseline["energy_trace_kWh"]
+        },
+        "trace": {"kind": trace_spec[0], "args": list(trace_spec[1])},
+        "created_at": datetime.now().isoformat()
+    }
+
+
+def save_profile(profile, path=WEIGHTS_PROFILE):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ajuste automático de los pesos de puntuación")
+    parser.add_argument("--trace", default=METRICAS_SQL, help="Volcado .sql o base SQLite con cluster_metrics")
+    parser.add_argument("--tasks", type=int, default=2000, help="Tareas sintéticas sobre --trace")
+    parser.add_argument("--synthetic", nargs=2, type=int, metavar=("NODOS", "TAREAS"),
+                        help="Traza sintética en lugar de --trace")
+    parser.add_argument("--candidates", type=int, default=20000)
+    parser.add_argument("--top", type=int, default=32, help="Candidatos que se simulan completos")
+    parser.add_argument("--system-load", default="normal", choices=["low", "normal", "high"])
+    parser.add_argument("--energy-weight", type=float, default=0.5)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--output", default=WEIGHTS_PROFILE)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        spec = ("synthetic", tuple(args.synthetic))
+    else:
+        spec = ("cluster_metrics", (args.trace, args.tasks))
+    profile = tune(spec, args.candidates, args.top, args.system_load, args.energy_weight, workers=args.workers)
+    save_profile(profile, args.output)
+    print(f"\n💾 Perfil guardado en {args.output}: {profile['weights']}")
+    print(f"   Se carga con MasterAgent(weights='{args.output}')")
@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+
+class RecommendationCache:
+    """Caché LRU con caducidad (TTL) para las recomendaciones del LLM"""
+
+    def __init__(self, ttl=60, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # {clave: (caduca_en, valor)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def quantize_cluster_state(nodes, system_load, cpu_bucket=10, ram_bucket=10, temp_bucket=5):
+    """Clave de caché: estado del clúster redondeado por tramos de CPU, RAM y temperatura"""
+    state = []
+    for node_id, data in nodes.items():
+        cpu = data.get("cpu_percent")
+        ram = data.get("ram_percent")
+        temp = data.get("cpu_temp")
+        state.append((
+            node_id,
+            None if cpu is None else int(cpu // cpu_bucket),
+            None if ram is None else int(ram // ram_bucket),
+            None if temp is None else int(temp // temp_bucket)
+        ))
+    state.sort()
+    return system_load, tuple(state)
+
+
+class OllamaAdvisor:
+    """Consulta el LLM en segundo plano con un plazo máximo y memoriza sus recomendaciones.
+
+    Como mucho hay 'workers' consultas en curso: con todas ocupadas no se encola ninguna
+    más (la cola del ThreadPoolExecutor no tiene límite) y se decide sin el LLM.
+    """
+
+    def __init__(self, deadline=0.5, ttl=60, max_entries=256, workers=2):
+        self.deadline = deadline
+        self.workers = workers
+        self.cache = RecommendationCache(ttl, max_entries)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ollama")
+        self._in_flight = {}  # {clave: future}, para no repetir la misma consulta
+        self._lock = threading.Lock()
+        self.skipped = 0  # Consultas no lanzadas por tener todos los workers ocupados
+
+    def advise(self, key, ask):
+        """Devuelve la recomendación para 'key' o None si no llega antes del plazo.
+
+        ask() hace la consulta real y devuelve la recomendación (o None); si tarda
+        más que el plazo sigue en segundo plano y su resultado queda en la caché.
+        Si ya hay 'workers' consultas en curso, devuelve None sin lanzarla.
+        """
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            created = future is None
+            if created:
+                if len(self._in_flight) >= self.workers:
+                    self.skipped += 1
+                    return None
+                future = self._executor.submit(ask)
+                self._in_flight[key] = future
+        if created:
+            # Fuera del lock: si ya terminó, el callback se ejecuta en este mismo hilo
+            future.add_done_callback(lambda f: self._store(key, f))
+
+        try:
+            return future.result(timeout=self.deadline)
+        except FutureTimeout:
+            return None
+        except Exception:
+            return None
+
+    def _store(self, key, future):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        if future.exception() is None and future.result() is not None:
+            self.cache.put(key, future.result())
@@ -0,0 +1,41 @@
+# Modelo de energía para el modo de consolidación: cuánto cuesta una tarea en cada nodo,
+# en qué orden se llenan los nodos y cuáles pueden apagarse (aparcarse) con poca carga.
+
+DEFAULT_TASK_SECONDS = 60  # duración supuesta mientras ningún nodo tenga historial
+
+
+def node_power(node_data, registered_watts):
+    """Potencia actual del nodo: la que reporta el esclavo (power_watts) o la registrada"""
+    power = node_data.get("power_watts")
+    return registered_watts if power is None else power
+
+
+def joules_per_task(power, avg_time, cores):
+    """Energía estimada de una tarea: la parte de un núcleo de la potencia del nodo durante avg_time"""
+    return power * avg_time / max(1, cores or 1)
+
+
+def packing_order(nodes):
+    """Orden de llenado: primero los nodos ya activos y, dentro de cada grupo, los de menos julios por tarea.
+
+    nodes: lista de {node_id, joules_per_task, idle, ...}. Se llenan antes los activos
+    para que los ociosos puedan quedarse parados.
+    """
+    return sorted(nodes, key=lambda node: (node["idle"], node["joules_per_task"], node["node_id"]))
+
+
+def parking_candidates(order, demand, min_awake=1):
+    """Nodos ociosos que sobran: los que quedan tras cubrir 'demand' núcleos siguiendo el orden de llenado.
+
+    Siempre quedan despiertos al menos min_awake nodos.
+    """
+    covered = 0.0
+    awake = 0
+    parked = []
+    for node in order:
+        if covered >= demand and awake >= min_awake and node["idle"]:
+            parked.append(node["node_id"])
+        else:
+            covered += node["free_cores"]
+            awake += 1
+    return parked
@@ -1,62 +1,542 @@
+import csv
+import math
+import os
 import psutil
+import queue
+import random
 import requests
+from requests.adapters import HTTPAdapter
+import threading
 import time
 import socket
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 # ===== CONFIGURACIÓN =====
 MASTER_IP = '10.160.37.73'
 MASTER_PORT = 5000
+# Maestros a los que preguntar por el shard de este nodo (en una federación sirve cualquiera)
+MASTER_URLS = [f"http://{MASTER_IP}:{MASTER_PORT}"]
 NODE_ID = socket.gethostname()
 ENERGY_WATTS = 120
-UPDATE_INTERVAL = 10
+UPDATE_INTERVAL = 10   # segundos entre envíos al maestro
+SAMPLE_INTERVAL = 2    # segundos entre muestras (se acumulan hasta el siguiente envío)
+FULL_EVERY = 10        # cada cuántos envíos se manda el estado completo
+MAX_BUFFERED = 100     # muestras que se guardan como máximo si el maestro no responde
+SAMPLER_RATE = 4       # lecturas por segundo del hilo de muestreo
+SAMPLER_WINDOW = 8     # lecturas que entran en la media móvil
+# Un campo solo se reenvía si cambia al menos este valor desde el último enviado
+DELTA_THRESHOLDS = {"cpu_percent": 2.0, "ram_percent": 1.0, "cpu_temp": 1.0, "power_watts": 1.0}
+# Ejecución de tareas: el nodo pide trabajo al maestro y lo ejecuta en un pool de procesos
+RUN_TASKS = True
+MAX_WORKERS = os.cpu_count() or 1  # Procesos del pool (tareas a la vez como máximo)
+POLL_WAIT = 20         # segundos de long-poll en /request_task
+IDLE_BACKOFF = 15      # segundos de espera si el maestro rechaza o aparca el nodo
+ADAPT_INTERVAL = 2     # cada cuánto se recalcula la concurrencia con el pool lleno
+RAM_HIGH = 90          # % de RAM a partir del cual no se aceptan tareas nuevas
+TEMP_HIGH = 80         # °C a partir de los que se usa como mucho la mitad de los núcleos
+TEMP_CRITICAL = 90     # °C a partir de los que no se aceptan tareas nuevas
+REPORT_RETRY = 5       # segundos entre reintentos de envío de resultados
+REQUEST_TIMEOUT = POLL_WAIT + 10  # plazo HTTP de /request_task (el long-poll más margen)
+
+# Sesión HTTP persistente (keep-alive) reutilizada en todos los envíos
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+
+def _read_sysfs_temp():
+    with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
+        temp_c = int(f.read()) / 1000
+    return temp_c if 0 < temp_c < 110 else None
+
+
+def _read_psutil_temp(key):
+    temps = psutil.sensors_temperatures().get(key)
+    if temps:
+        return round(sum([t.current for t in temps]) / len(temps), 1)
+    return None
+
+
+# Fuente de temperatura que funcionó la última vez (None = no se ha buscado)
+_temp_source = None
+
+
+def _find_temp_source():
+    candidates = [_read_sysfs_temp] + [
+        (lambda key=key: _read_psutil_temp(key)) for key in ["coretemp", "k10temp", "cpu_thermal"]
+    ]
+    for source in candidates:
+        try:
+            if source() is not None:
+                return source
+        except Exception:
+            pass
+    return lambda: None
+
 
 def get_cpu_temp_linux():
+    """Lee la temperatura con la fuente cacheada; si deja de funcionar se vuelve a buscar"""
+    global _temp_source
+    if _temp_source is None:
+        _temp_source = _find_temp_source()
     try:
-        with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
-            temp_str = f.read()
-            temp_c = int(temp_str) / 1000
-            if 0 < temp_c < 110:
-                return temp_c
+        return _temp_source()
     except Exception:
-        pass
-    try:
-        temps = psutil.sensors_temperatures()
-        for key in ["coretemp", "k10temp", "cpu_thermal"]:
-            if key in temps and temps[key]:
-                return round(sum([t.current for t in temps[key]]) / len(temps[key]), 1)
-    except Exception:
-        pass
-    return None
+        _temp_source = None
+        return None
+
 
 def get_hardware_info():
+    """Última muestra del hilo de muestreo, o una lectura directa si no está en marcha"""
+    if sampler.is_alive():
+        return sampler.snapshot()
     return {
         "node_id": NODE_ID,
-        "cpu_percent": psutil.cpu_percent(interval=1),
+        "cpu_cores": psutil.cpu_count(),
+        "cpu_percent": psutil.cpu_percent(interval=None),  # desde la llamada anterior, sin bloquear
+        "ram_total_GB": round(psutil.virtual_memory().total / 1024 ** 3, 1),
         "ram_percent": psutil.virtual_memory().percent,
         "cpu_temp": get_cpu_temp_linux(),
         "power_watts": ENERGY_WATTS
     }
 
-def send_metrics():
+
+class MetricsSampler(threading.Thread):
+    """Muestrea CPU, RAM y temperatura en segundo plano y mantiene medias móviles"""
+
+    def __init__(self, rate=SAMPLER_RATE, window=SAMPLER_WINDOW):
+        super().__init__(daemon=True, name="muestreo")
+        self.interval = 1 / rate
+        self.cpu = deque(maxlen=window)
+        self.ram = deque(maxlen=window)
+        self.temp = deque(maxlen=window)
+        self.cpu_cores = psutil.cpu_count()
+        self.ram_total_GB = round(psutil.virtual_memory().total / 1024 ** 3, 1)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        psutil.cpu_percent(interval=None)  # La primera llamada solo fija la referencia
+        while not self._stop_event.wait(self.interval):
+            cpu = psutil.cpu_percent(interval=None)
+            ram = psutil.virtual_memory().percent
+            temp = get_cpu_temp_linux()
+            with self._lock:
+                self.cpu.append(cpu)
+                self.ram.append(ram)
+                if temp is not None:
+                    self.temp.append(temp)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def snapshot(self):
+        """Medias de la ventana actual; no bloquea más que el tiempo de copiarla"""
+        with self._lock:
+            cpu, ram, temp = list(self.cpu), list(self.ram), list(self.temp)
+        return {
+            "node_id": NODE_ID,
+            "cpu_cores": self.cpu_cores,
+            "cpu_percent": round(sum(cpu) / len(cpu), 1) if cpu else None,
+            "ram_total_GB": self.ram_total_GB,
+            "ram_percent": round(sum(ram) / len(ram), 1) if ram else None,
+            "cpu_temp": round(sum(temp) / len(temp), 1) if temp else None,
+            "power_watts": ENERGY_WATTS
+        }
+
+
+sampler = MetricsSampler()
+
+
+class DeltaEncoder:
+    """Quita de cada muestra los campos que no han cambiado lo suficiente desde el último envío"""
+
+    def __init__(self, thresholds):
+        self.thresholds = thresholds
+        self.last_sent = {}
+
+    def encode(self, sample, full=False):
+        delta = {"node_id": sample["node_id"], "timestamp": sample["timestamp"]}
+        for field, value in sample.items():
+            if field in delta:
+                continue
+            last = self.last_sent.get(field)
+            threshold = self.thresholds.get(field)
+            if field not in self.last_sent:
+                changed = True
+            elif threshold is None or value is None or last is None:
+                changed = value != last
+            else:
+                changed = abs(value - last) >= threshold
+            if full or changed:
+                delta[field] = value
+                self.last_sent[field] = value
+        return delta
+
+    def reset(self):
+        """Tras un fallo de envío se vuelve a mandar todo"""
+        self.last_sent = {}
+
+
+encoder = DeltaEncoder(DELTA_THRESHOLDS)
+
+
+_masters = []  # Maestros de este nodo por orden de preferencia (el dueño de su shard primero)
+
+
+def resolve_masters():
+    """Pregunta a MASTER_URLS por el shard de este nodo; sin federación se usa el maestro que responda"""
+    for seed in MASTER_URLS:
+        try:
+            response = session.get(f"{seed}/federation/route", params={"node_id": NODE_ID}, timeout=5)
+        except Exception as e:
+            print(f"Maestro {seed} no disponible: {e}")
+            continue
+        if response.status_code == 404:  # Maestro sin federación
+            return [seed]
+        if response.ok:
+            route = response.json()
+            print(f"🧭 Shard {route['shard']}: {route['url']}")
+            return [route["url"]] + route["fallbacks"]
+    return list(MASTER_URLS)
+
+
+def master_url():
+    global _masters
+    if not _masters:
+        _masters = resolve_masters()
+    return _masters[0]
+
+
+def master_failed():
+    """El maestro actual no responde: se pasa al siguiente (al agotarlos se vuelve a preguntar la ruta)"""
+    if _masters:
+        _masters.pop(0)
+
+
+def send_metrics(samples, full=False):
+    """Envía un lote de muestras (deltas) al endpoint de ingesta masiva"""
+    batch = [encoder.encode(sample, full=full and i == 0) for i, sample in enumerate(samples)]
+    # Las muestras sin cambios no se envían, pero siempre va al menos una como latido
+    batch = [batch[0]] + [sample for sample in batch[1:] if len(sample) > 2]
     try:
-        metrics = get_hardware_info()
-        url = f"http://{MASTER_IP}:{MASTER_PORT}/update_metrics"
-        requests.post(url, json=metrics, timeout=5)
-        print(f"Métricas enviadas: {metrics}")
+        url = f"{master_url()}/update_metrics_bulk"
+        session.post(url, json={"node_id": NODE_ID, "samples": batch}, timeout=5).raise_for_status()
+        print(f"Métricas enviadas: {len(batch)} muestras, última {samples[-1]}")
         return True
     except Exception as e:
+        encoder.reset()
+        master_failed()
         print(f"Error enviando métricas: {e}")
         return False
 
+
+# ===== EJECUCIÓN DE TAREAS =====
+# Handlers por task_data['type']: reciben task_data y devuelven un resultado serializable a JSON.
+# Se ejecutan en otro proceso, así que deben ser funciones de nivel de módulo.
+TASK_HANDLERS = {}
+
+
+def task_handler(kind):
+    """Registra la función decorada como handler de las tareas de tipo 'kind'"""
+    def register(fn):
+        TASK_HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+@task_handler("train_model")
+def train_model(data):
+    """Regresión logística por descenso de gradiente sobre datos sintéticos ('epochs', 'samples')"""
+    rng = random.Random(data.get("seed", 0))
+    features = int(data.get("features", 8))
+    true_weights = [rng.uniform(-1, 1) for _ in range(features)]
+    rows = []
+    for _ in range(int(data.get("samples", 2000))):
+        x = [rng.gauss(0, 1) for _ in range(features)]
+        rows.append((x, 1 if sum(w * v for w, v in zip(true_weights, x)) > 0 else 0))
+    weights = [0.0] * features
+    rate = float(data.get("learning_rate", 0.1))
+    loss = 0.0
+    for _ in range(int(data.get("epochs", 1))):
+        loss = 0.0
+        for x, y in rows:
+            p = 1 / (1 + math.exp(-max(-30.0, min(30.0, sum(w * v for w, v in zip(weights, x))))))
+            loss -= math.log(p if y else 1 - p) if 0 < p < 1 else 0.0
+            weights = [w - rate * (p - y) * v for w, v in zip(weights, x)]
+        loss /= len(rows) or 1
+    correct = sum(1 for x, y in rows if (sum(w * v for w, v in zip(weights, x)) > 0) == bool(y))
+    return {"loss": round(loss, 4), "accuracy": round(correct / (len(rows) or 1), 4)}
+
+
+@task_handler("process_data")
+def process_data(data):
+    """Filas y estadísticas (media, mínimo, máximo) de las columnas numéricas de un CSV ('file')"""
+    columns = {}
+    rows = 0
+    with open(data["file"], newline="") as f:
+        for row in csv.DictReader(f):
+            rows += 1
+            for name, value in row.items():
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+                stats = columns.setdefault(name, {"count": 0, "sum": 0.0, "min": value, "max": value})
+                stats["count"] += 1
+                stats["sum"] += value
+                stats["min"] = min(stats["min"], value)
+                stats["max"] = max(stats["max"], value)
+    return {"rows": rows, "columns": {name: {"mean": stats["sum"] / stats["count"], "min": stats["min"],
+                                             "max": stats["max"]} for name, stats in columns.items()}}
+
+
+@task_handler("simulation")
+def simulation(data):
+    """Paseos aleatorios 2D: params.x caminantes de params.steps pasos, distancia final media"""
+    params = data.get("params") or {}
+    rng = random.Random(params.get("seed", 0))
+    walkers, steps = int(params.get("x", 100)), int(params.get("steps", 1000))
+    total = 0.0
+    for _ in range(walkers):
+        x = y = 0.0
+        for _ in range(steps):
+            angle = rng.uniform(0, 2 * math.pi)
+            x += math.cos(angle)
+            y += math.sin(angle)
+        total += math.hypot(x, y)
+    return {"walkers": walkers, "steps": steps, "mean_distance": round(total / (walkers or 1), 3)}
+
+
+def run_task(task_data):
+    """Se ejecuta en un proceso del pool: llama al handler del tipo de la tarea"""
+    kind = task_data.get("type") if isinstance(task_data, dict) else None
+    handler = TASK_HANDLERS.get(kind)
+    if handler is None:
+        raise ValueError(f"No hay handler para el tipo de tarea {kind!r}")
+    start = time.perf_counter()
+    output = handler(task_data)
+    return {"output": output, "seconds": round(time.perf_counter() - start, 3)}
+
+
+def target_concurrency(sample, running, cores):
+    """Cuántas tareas puede tener el nodo a la vez según la última muestra de CPU, RAM y temperatura.
+
+    La CPU de la muestra incluye la de las tareas propias, así que solo se descuentan los
+    núcleos que ocupa otra cosa (se supone que cada tarea en marcha llena un núcleo).
+    """
+    limit = cores
+    cpu = sample.get("cpu_percent")
+    if cpu is not None:
+        external = max(0.0, cpu - 100 * min(running, cores) / cores)
+        limit = max(1, cores - int(external * cores / 100))
+    temp = sample.get("cpu_temp")
+    if temp is not None:
+        if temp >= TEMP_CRITICAL:
+            return 0
+        if temp >= TEMP_HIGH:
+            limit = min(limit, max(1, cores // 2))
+    ram = sample.get("ram_percent")
+    if ram is not None and ram >= RAM_HIGH:
+        limit = min(limit, running)  # No se aceptan nuevas hasta que baje
+    return limit
+
+
+class TaskRunner(threading.Thread):
+    """Pide tareas al maestro, las ejecuta en un pool de procesos y envía los resultados en lote.
+
+    El hilo principal solo pide tareas cuando hay huecos según target_concurrency(); cada
+    tarea que termina deja su resultado en una cola que otro hilo envía a /complete_task,
+    de modo que un maestro lento no retrasa la siguiente petición de trabajo.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        super().__init__(daemon=True, name="tareas")
+        self.max_workers = max_workers
+        self.pool = ProcessPoolExecutor(max_workers)
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.results = queue.Queue()
+        self._cond = threading.Condition()
+        self._broken = False
+        self._stop_event = threading.Event()
+        self._reporter = threading.Thread(target=self._report_loop, daemon=True, name="resultados")
+
+    def limit(self):
+        return min(self.max_workers, target_concurrency(get_hardware_info(), self.running, self.max_workers))
+
+    def run(self):
+        self._reporter.start()
+        while not self._stop_event.is_set():
+            with self._cond:
+                while self.running >= self.limit() and not self._stop_event.is_set():
+                    self._cond.wait(ADAPT_INTERVAL)
+                free = self.limit() - self.running
+            if self._stop_event.is_set():
+                break
+            if self._broken:
+                self._rebuild_pool()
+            tasks, pause = self.request_tasks(free)
+            for task in tasks:
+                self._submit(task)
+            if pause:
+                self._stop_event.wait(pause)
+
+    def request_tasks(self, n):
+        """Pide hasta n tareas con long-poll; devuelve (tareas, segundos de espera antes de reintentar)"""
+        try:
+            response = session.post(f"{master_url()}/request_task",
+                                    json={"node_id": NODE_ID, "max_tasks": n, "wait": POLL_WAIT},
+                                    timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            body = response.json()
+        except Exception as e:
+            master_failed()
+            print(f"Error pidiendo tareas: {e}")
+            return [], REPORT_RETRY
+        if body.get("status") == "tasks_assigned":
+            return body["tasks"], 0
+        if body.get("status") in ("rejected", "parked"):
+            print(f"⏸️ Maestro: {body['status']} ({body.get('reason')})")
+            return [], IDLE_BACKOFF
+        return [], 0  # no_tasks: el long-poll ya ha esperado
+
+    def _submit(self, task):
+        with self._cond:
+            self.running += 1
+        print(f"▶️ Tarea {task['task_id']} ({task['data'].get('type') if isinstance(task['data'], dict) else '?'})"
+              f", {self.running} en marcha")
+        try:
+            future = self.pool.submit(run_task, task['data'])
+        except BrokenProcessPool as e:
+            self._broken = True  # Se recrea antes de la siguiente petición
+            self._finish(task['task_id'], {"error": f"{type(e).__name__}: {e}"}, False)
+            return
+        except RuntimeError:
+            # Pool ya cerrado: solo si stop() no pudo esperar a la última petición
+            print(f"⚠️ Tarea {task['task_id']} recibida con el pool cerrado: vuelve a la cola al vencer el lease")
+            with self._cond:
+                self.running -= 1
+            return
+        future.add_done_callback(lambda f, task_id=task['task_id']: self._done(task_id, f))
+
+    def _done(self, task_id, future):
+        try:
+            result, success = future.result(), True
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self._broken = True  # Un proceso del pool murió (p. ej. sin memoria)
+            result, success = {"error": f"{type(e).__name__}: {e}"}, False
+        self._finish(task_id, result, success)
+
+    def _finish(self, task_id, result, success):
+        self.results.put({"task_id": task_id, "result": result, "success": success})
+        with self._cond:
+            self.running -= 1
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self._cond.notify()
+        print(f"{'✅' if success else '❌'} Tarea {task_id} terminada: {result}")
+
+    def _rebuild_pool(self):
+        print("♻️ Pool de procesos roto, se crea uno nuevo")
+        self.pool.shutdown(wait=False)
+        self.pool = ProcessPoolExecutor(self.max_workers)
+        self._broken = False
+
+    def _report_loop(self):
+        """Envía los resultados en lote; si el maestro no responde o falla se reintenta con los mismos"""
+        while True:
+            batch = [self.results.get()]
+            if batch[0] is None:
+                return
+            while True:
+                try:
+                    item = self.results.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.results.put(None)  # Se termina después de enviar este lote
+                    break
+                batch.append(item)
+            while not self._send_results(batch):
+                time.sleep(REPORT_RETRY)
+
+    def _send_results(self, batch):
+        """True si el lote está entregado o no tiene arreglo; False si hay que reintentarlo.
+
+        Solo se reintenta si el maestro no responde o falla (5xx): un 4xx es un lote que
+        el maestro nunca va a aceptar, y reintentarlo bloquearía los siguientes para siempre.
+        """
+        try:
+            response = session.post(f"{master_url()}/complete_task",
+                                    json={"node_id": NODE_ID, "results": batch}, timeout=10)
+        except requests.RequestException as e:
+            master_failed()
+            print(f"Error enviando resultados: {e}")
+            return False
+        if response.status_code >= 500:
+            master_failed()
+            print(f"Error enviando resultados: el maestro respondió {response.status_code}")
+            return False
+        if response.status_code >= 400:
+            task_ids = [result.get("task_id") for result in batch]
+            print(f"❌ El maestro rechazó los resultados de {task_ids} ({response.status_code}): "
+                  f"{response.text[:200]}; se descartan")
+            return True
+        not_found = response.json().get("not_found")
+        if not_found:
+            print(f"⚠️ El maestro ya no tenía las tareas {not_found} (lease vencido)")
+        return True
+
+    def stop(self):
+        """Deja de pedir tareas, espera a las que están en marcha y envía sus resultados"""
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify()
+        # Si el hilo está en un long-poll, las tareas que le lleguen todavía se ejecutan:
+        # el pool se cierra cuando ha terminado la última petición
+        if self.is_alive():
+            self.join(REQUEST_TIMEOUT)
+        self.pool.shutdown(wait=True)
+        self.results.put(None)
+        self._reporter.join()
+
+
 if __name__ == "__main__":
     print(f"\n🖥️ Nodo Dinámico: {NODE_ID}")
-    print(f"🎯 Maestro: {MASTER_IP}:{MASTER_PORT}\n")
+    print(f"🎯 Maestro: {master_url()}\n")
+    sampler.start()
+    time.sleep(sampler.interval * 2)  # Esperar a la primera lectura
+    runner = None
+    if RUN_TASKS:
+        runner = TaskRunner()
+        runner.start()
+        print(f"⚙️ Ejecutando tareas con hasta {runner.max_workers} procesos")
+    samples = []
+    sends = 0
+    last_send = 0
     while True:
         try:
-            send_metrics()
-            time.sleep(UPDATE_INTERVAL)
+            sample = get_hardware_info()
+            sample["timestamp"] = time.time()
+            samples.append(sample)
+            if time.time() - last_send >= UPDATE_INTERVAL:
+                if send_metrics(samples, full=sends % FULL_EVERY == 0):
+                    samples = []
+                else:
+                    samples = samples[-MAX_BUFFERED:]
+                sends += 1
+                last_send = time.time()
+            time.sleep(SAMPLE_INTERVAL)
         except KeyboardInterrupt:
             print("\n👋 Deteniendo esclavo...")
+            if runner is not None:
+                runner.stop()
             break
         except Exception as e:
             print(f"Error: {e}")
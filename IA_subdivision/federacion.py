@@ -0,0 +1,378 @@
+import argparse
+import hashlib
+import logging
+import math
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+import requests
+from flask import request, jsonify
+
+import agente
+from agente import MasterAgent, MAX_TASKS_PER_REQUEST, WEIGHTS_PROFILE, app
+from instrumentacion import configure_logging
+
+log = logging.getLogger("federacion")
+
+# === FEDERACIÓN DE MAESTROS ===
+# Varios maestros, cada uno dueño de un shard de nodos y tareas repartidos por hash
+# (rendezvous hashing sobre la lista de URLs, que tiene que ser la misma en todos).
+# - Los esclavos preguntan a cualquier maestro por /federation/route y hablan con su dueño.
+# - Las tareas que llegan a un maestro que no es su dueño se reenvían al dueño.
+# - Cuando a un maestro no le queda trabajo para un nodo, roba tareas de otro shard.
+
+HANDOFF_SECONDS = 30  # Plazo para confirmar una cesión antes de que el que cede la reencole
+CONFIRM_ATTEMPTS = 3  # Intentos de confirmar una cesión (muy por debajo de HANDOFF_SECONDS)
+CONFIRM_RETRY = 0.2  # Espera base entre intentos, en segundos (crece con cada intento)
+RESOURCE_FIELDS = ("cores", "ram_GB", "temp")  # Recursos libres que manda el ladrón en /federation/steal
+
+
+def _weight(key, url):
+    digest = hashlib.blake2b(f"{url}|{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class ShardRing:
+    """Reparto de claves entre shards por rendezvous hashing.
+
+    Cada clave va al shard con mayor hash(url, clave). Si un shard cae, sus claves
+    pasan al siguiente de su ranking y las del resto no se mueven.
+    """
+
+    def __init__(self, urls):
+        self.urls = list(urls)
+
+    def __len__(self):
+        return len(self.urls)
+
+    def ranking(self, key):
+        """Índices de los shards de preferido a menos preferido para la clave"""
+        return sorted(range(len(self.urls)), key=lambda i: _weight(key, self.urls[i]), reverse=True)
+
+    def owner(self, key):
+        return max(range(len(self.urls)), key=lambda i: _weight(key, self.urls[i]))
+
+
+class FederatedMasterAgent(MasterAgent):
+    """Maestro de un shard: reenvía las tareas de otros shards y roba trabajo cuando se queda sin él"""
+
+    def __init__(self, shard_urls, shard_index, peer_timeout=1.0, steal_backoff=2.0, **kwargs):
+        # IDs de tarea índice, índice + N, índice + 2N...: no se repiten entre shards
+        super().__init__(task_id_offset=shard_index, task_id_stride=len(shard_urls), **kwargs)
+        self.ring = ShardRing(shard_urls)
+        self.shard_index = shard_index
+        self.shard_url = self.ring.urls[shard_index]
+        self.peer_timeout = peer_timeout
+        # Tras un intento de robo sin éxito, ese shard no se vuelve a probar en steal_backoff segundos
+        self.steal_backoff = steal_backoff
+        self._peer_empty_until = {}  # {url: instante}
+        self.session = requests.Session()
+        self.federation_stats = Counter()  # forwarded, forward_failures, stolen, released, unconfirmed
+        self._stats_lock = threading.Lock()
+
+    def _count(self, stat, n=1):
+        with self._stats_lock:
+            self.federation_stats[stat] += n
+
+    def _post(self, shard, path, body):
+        response = self.session.post(f"{self.ring.urls[shard]}{path}", json=body, timeout=self.peer_timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def owns_node(self, node_id):
+        return self.ring.owner(node_id) == self.shard_index
+
+    def add_task(self, task_data):
+        """Encola la tarea en su shard: task_data['partition_key'] o, sin ella, una clave aleatoria"""
+        key = task_data.get('partition_key') if isinstance(task_data, dict) else None
+        owner = self.ring.owner(str(key) if key is not None else uuid.uuid4().hex)
+        if owner != self.shard_index:
+            try:
+                task_id = self._post(owner, '/federation/add_task', {"task_data": task_data})['task_id']
+                self._count('forwarded')
+                return task_id
+            except Exception as e:
+                # Mejor desequilibrar el reparto que perder la tarea
+                self._count('forward_failures')
+                log.warning("⚠️ Shard %s no disponible (%s): la tarea se queda aquí", self.ring.urls[owner], e)
+        return self.add_local_task(task_data)
+
+    def add_local_task(self, task_data):
+        return super().add_task(task_data)
+
+    def get_next_tasks_for_node(self, node_id, max_tasks=1, timeout=0):
+        """Como en MasterAgent, pero si la cola propia no tiene nada para el nodo se roba de otro shard"""
+        tasks = super().get_next_tasks_for_node(node_id, max_tasks)
+        if tasks:
+            return tasks
+        if self.steal_tasks(node_id, max_tasks):
+            tasks = super().get_next_tasks_for_node(node_id, max_tasks)
+        if not tasks and timeout > 0:
+            tasks = super().get_next_tasks_for_node(node_id, max_tasks, timeout)
+        return tasks
+
+    def release_tasks(self, holder, free=None, max_tasks=1, handoff_seconds=HANDOFF_SECONDS):
+        tasks = super().release_tasks(holder, free, max_tasks, handoff_seconds)
+        self._count('released', len(tasks))
+        return tasks
+
+    def steal_tasks(self, node_id, max_tasks=1):
+        """Pide a los otros shards tareas que quepan en el nodo; devuelve cuántas se han traído.
+
+        Los shards se prueban en el orden de ranking del nodo (cada ladrón empieza por una
+        víctima distinta) y hasta el primero que cede algo.
+        """
+        free = self.get_node_resources(node_id)
+        now = self.clock()
+        for shard in self.ring.ranking(node_id):
+            url = self.ring.urls[shard]
+            if shard == self.shard_index or self._peer_empty_until.get(url, 0) > now:
+                continue
+            try:
+                tasks = self._post(shard, '/federation/steal',
+                                   {"thief": self.shard_url, "free": free, "max_tasks": max_tasks})['tasks']
+            except Exception as e:
+                log.warning("⚠️ No se pudo robar trabajo de %s: %s", url, e)
+                tasks = []
+            if not tasks:
+                self._peer_empty_until[url] = now + self.steal_backoff
+                continue
+
+            # Solo se encolan las que el otro shard da por entregadas: las que no confirma
+            # las reencola él al vencer la cesión, y así ninguna se ejecuta en los dos
+            confirmed = self._confirm(shard, [task['task_id'] for task in tasks])
+            tasks = [task for task in tasks if task['task_id'] in confirmed]
+            if not tasks:
+                continue
+            self.adopt_tasks(tasks)
+            self._count('stolen', len(tasks))
+            log.info("🔀 %d tareas robadas a %s para %s", len(tasks), url, node_id)
+            return len(tasks)
+        return 0
+
+    def _confirm(self, shard, task_ids):
+        """Confirma la cesión con reintentos; devuelve los IDs que el otro shard da por entregados.
+
+        confirm_handoff es idempotente para el mismo ladrón, así que reintentar tras una
+        respuesta perdida devuelve las que ya se confirmaron.
+        """
+        url = self.ring.urls[shard]
+        for attempt in range(CONFIRM_ATTEMPTS):
+            if attempt:
+                time.sleep(CONFIRM_RETRY * attempt)
+            try:
+                return set(self._post(shard, '/federation/confirm',
+                                       {"thief": self.shard_url, "task_ids": task_ids})['confirmed'])
+            except Exception as e:
+                log.warning("⚠️ Cesión de %s sin confirmar en %s (intento %d/%d): %s",
+                            task_ids, url, attempt + 1, CONFIRM_ATTEMPTS, e)
+        self._count('unconfirmed', len(task_ids))
+        return set()
+
+    def get_federation_status(self):
+        with self._stats_lock:
+            stats = dict(self.federation_stats)
+        nodes = self.get_nodes_snapshot()
+        return {
+            'shard': self.shard_index,
+            'url': self.shard_url,
+            'shards': self.ring.urls,
+            'queue': self.get_queue_status(),
+            'nodes_owned': sorted(node_id for node_id in nodes if self.owns_node(node_id)),
+            'nodes_foreign': sorted(node_id for node_id in nodes if not self.owns_node(node_id)),
+            'stats': stats
+        }
+
+
+# Lógica de los endpoints de la federación, compartida con servidor_async.py.
+# Un maestro sin federación responde 404, como si no tuviera estos endpoints.
+
+NOT_FEDERATED = {"error": "Maestro no federado"}, 404
+
+
+def handle_route(master, args):
+    """Shard dueño de un nodo y, por si cae, los siguientes de su ranking"""
+    if not isinstance(master, FederatedMasterAgent):
+        return NOT_FEDERATED
+    node_id = args.get('node_id')
+    if not node_id:
+        return {"error": "node_id requerido"}, 400
+    ranking = master.ring.ranking(node_id)
+    return {
+        "node_id": node_id,
+        "shard": ranking[0],
+        "url": master.ring.urls[ranking[0]],
+        "fallbacks": [master.ring.urls[shard] for shard in ranking[1:]]
+    }, 200
+
+
+def handle_federated_add_task(master, data):
+    """Tarea reenviada por otro shard: se encola aquí sin volver a repartirla"""
+    if not isinstance(master, FederatedMasterAgent):
+        return NOT_FEDERATED
+    task_data = data.get('task_data')
+    if not task_data:
+        return {"error": "task_data requerido"}, 400
+    return {"status": "task_added", "task_id": master.add_local_task(task_data)}, 200
+
+
+def _parse_free(free):
+    """Recursos libres que manda el ladrón: None o {cores, ram_GB, temp} con números o None.
+
+    Devuelve (recursos, error); los campos que falten quedan a None (sin límite), como
+    en los nodos que no informan de temperatura.
+    """
+    if free is None:
+        return None, None
+    if not isinstance(free, dict):
+        return None, "free debe ser un objeto"
+    parsed = {}
+    for field in RESOURCE_FIELDS:
+        value = free.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))
+                                  or not math.isfinite(value)):
+            return None, f"free.{field} debe ser numérico"
+        parsed[field] = value
+    return parsed, None
+
+
+def handle_steal(master, data):
+    if not isinstance(master, FederatedMasterAgent):
+        return NOT_FEDERATED
+    thief = data.get('thief')
+    if not thief:
+        return {"error": "thief requerido"}, 400
+    try:
+        max_tasks = min(max(1, int(data.get('max_tasks', 1))), MAX_TASKS_PER_REQUEST)
+    except (TypeError, ValueError):
+        return {"error": "max_tasks debe ser un entero"}, 400
+    free, error = _parse_free(data.get('free'))
+    if error:
+        return {"error": error}, 400
+    tasks = master.release_tasks(f"shard:{thief}", free, max_tasks)
+    return {"tasks": tasks, "pending": master.task_queue.qsize()}, 200
+
+
+def handle_confirm(master, data):
+    if not isinstance(master, FederatedMasterAgent):
+        return NOT_FEDERATED
+    task_ids = data.get('task_ids')
+    if not isinstance(task_ids, list):
+        return {"error": "task_ids (lista) requerido"}, 400
+    thief = data.get('thief')
+    if not thief:
+        return {"error": "thief requerido"}, 400
+    return {"confirmed": master.confirm_handoff(task_ids, f"shard:{thief}")}, 200
+
+
+def handle_federation_status(master):
+    if not isinstance(master, FederatedMasterAgent):
+        return NOT_FEDERATED
+    status = master.get_federation_status()
+    status['timestamp'] = datetime.now().isoformat()
+    return status, 200
+
+
+# === ENDPOINTS FLASK ===
+# Usan el maestro de agente.py (agente.master), el mismo que el resto de endpoints
+
+@app.route('/federation/route', methods=['GET'])
+def federation_route():
+    """Shard al que tiene que hablar un esclavo"""
+    body, code = handle_route(agente.master, request.args)
+    return jsonify(body), code
+
+
+@app.route('/federation/add_task', methods=['POST'])
+def federation_add_task():
+    body, code = handle_federated_add_task(agente.master, request.get_json())
+    return jsonify(body), code
+
+
+@app.route('/federation/steal', methods=['POST'])
+def federation_steal():
+    """Otro shard se ha quedado sin trabajo y pide tareas"""
+    body, code = handle_steal(agente.master, request.get_json())
+    return jsonify(body), code
+
+
+@app.route('/federation/confirm', methods=['POST'])
+def federation_confirm():
+    body, code = handle_confirm(agente.master, request.get_json())
+    return jsonify(body), code
+
+
+@app.route('/federation/status', methods=['GET'])
+def federation_status():
+    body, code = handle_federation_status(agente.master)
+    return jsonify(body), code
+
+
+def start_local(n_shards, base_port=5000, host="127.0.0.1", **popen_kwargs):
+    """Arranca n_shards maestros en localhost (un proceso por shard); devuelve (urls, procesos)"""
+    urls = [f"http://{host}:{base_port + i}" for i in range(n_shards)]
+    processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                   "--shard-urls", ",".join(urls), "--index", str(i)], **popen_kwargs)
+                 for i in range(n_shards)]
+    return urls, processes
+
+
+def launch_local(n_shards, base_port=5000, host="127.0.0.1"):
+    """Arranca n_shards maestros en localhost y espera a que terminen"""
+    _, processes = start_local(n_shards, base_port, host)
+    # Ctrl+C o SIGTERM al lanzador paran también los maestros
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maestro federado (un shard) o varios en localhost")
+    parser.add_argument("--shard-urls", help="URLs de todos los maestros, separadas por comas y en el mismo orden")
+    parser.add_argument("--index", type=int, help="Posición de este maestro en --shard-urls")
+    parser.add_argument("--local", type=int, metavar="N", help="Arranca N maestros en localhost")
+    parser.add_argument("--base-port", type=int, default=5000)
+    parser.add_argument("--weights", help="Perfil de pesos generado por ajuste_pesos.py")
+    args = parser.parse_args()
+
+    if args.local:
+        launch_local(args.local, args.base_port)
+        sys.exit(0)
+    if not args.shard_urls or args.index is None:
+        parser.error("hacen falta --shard-urls e --index, o --local N")
+
+    configure_logging()
+    urls = args.shard_urls.split(",")
+    weights = args.weights or (WEIGHTS_PROFILE if os.path.exists(WEIGHTS_PROFILE) else None)
+    master = FederatedMasterAgent(urls, args.index, weights=weights,
+                                  completed_db=f'tareas_completadas_{args.index}.db',
+                                  metrics_db=f'metricas_cluster_{args.index}.db')
+    agente.master = master
+    master.start_reaper()
+
+    port = int(urls[args.index].rsplit(":", 1)[1])
+    print(f"\n🚀 Maestro federado {args.index + 1}/{len(urls)} en {urls[args.index]}")
+    print("📡 Endpoints de la federación:")
+    print("   - GET  /federation/route  : Shard de un nodo (node_id=...)")
+    print("   - GET  /federation/status : Cola, nodos propios y ajenos, tareas reenviadas y robadas\n")
+
+    # launch_local para los shards con SIGTERM: así también se cierran los ficheros
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        app.run(host='0.0.0.0', port=port, debug=False)
+    finally:
+        master.stop_reaper()
+        master.close()
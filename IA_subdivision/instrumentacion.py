@@ -0,0 +1,319 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+# === INSTRUMENTACIÓN DEL MAESTRO ===
+# Contadores, histogramas de latencia y gauges con exportación en formato de texto de
+# Prometheus, un perfilador por muestreo opcional y logging con buffer (los mensajes
+# se escriben en un hilo aparte, no en el que atiende la petición).
+
+# Latencias en segundos: de 50 µs a 10 s
+LATENCY_BUCKETS = (5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0)
+# Tiempo en cola de una tarea: de 10 ms a 1 día
+WAIT_BUCKETS = (0.01, 0.1, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0, 14400.0, 86400.0)
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+class CounterMetric:
+    """Contador monótono, opcionalmente con etiquetas"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = Counter()
+        if not self.labelnames:
+            self._values[()] = 0  # Sin etiquetas se exporta desde el principio, aunque valga 0
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def value(self, *labels):
+        return self._values[labels]
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, _format_labels(self.labelnames, labels), value) for labels, value in values.items()]
+
+
+class Histogram:
+    """Histograma con cubos fijos: observe() es una búsqueda binaria y tres sumas bajo un lock"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # {etiquetas: [cuentas por cubo..., +Inf, suma, total]}
+        if not self.labelnames:
+            self._series[()] = [0] * (len(self.buckets) + 3)
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *labels):
+        """Context manager que observa la duración del bloque"""
+        return _Timer(self, labels)
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series[-1] if series else 0
+
+    def samples(self):
+        with self._lock:
+            all_series = {labels: list(series) for labels, series in self._series.items()}
+        samples = []
+        for labels, series in all_series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), series):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append((f"{self.name}_bucket", _format_labels(self.labelnames, labels, [("le", le)]),
+                                cumulative))
+            samples.append((f"{self.name}_sum", _format_labels(self.labelnames, labels), series[-2]))
+            samples.append((f"{self.name}_count", _format_labels(self.labelnames, labels), series[-1]))
+        return samples
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram, self.labels = histogram, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Gauge:
+    """Valor que se lee al exportar: fn() devuelve un número o {etiquetas: número}"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labelnames=()):
+        self.name, self.help, self.fn, self.labelnames = name, help, fn, tuple(labelnames)
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            return [(self.name, "", value)]
+        return [(self.name, _format_labels(self.labelnames, labels), v) for labels, v in value.items()]
+
+
+class MetricsRegistry:
+    """Conjunto de métricas con nombre; render() las exporta en formato de texto de Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Métrica repetida: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(CounterMetric(name, help, labelnames))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        return self._add(Histogram(name, help, buckets, labelnames))
+
+    def gauge(self, name, help, fn, labelnames=()):
+        return self._add(Gauge(name, help, fn, labelnames))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """Perfilador por muestreo: cada 'interval' segundos apunta la pila de cada hilo.
+
+    No instrumenta nada, así que con el perfilador parado no cuesta nada. collapsed()
+    devuelve las pilas en el formato de flamegraph.pl ("a;b;c cuenta" por línea).
+    """
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="perfilador")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, frame in frames.items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(stack)))
+            with self._lock:
+                self.stacks.update(stacks)
+                self.samples += 1
+
+    def collapsed(self, top=None):
+        with self._lock:
+            stacks = self.stacks.most_common(top)
+        return "".join(f"{stack} {n}\n" for stack, n in stacks)
+
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.samples = 0
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Encola el registro sin formatear: el mensaje y la traza se componen en el hilo escritor.
+
+    QueueHandler.prepare() formatea en el hilo que llama, que es justo el coste que se quiere
+    sacar del camino caliente. Los argumentos del mensaje viajan tal cual, así que no deben
+    modificarse después de llamar al logger (en el maestro son IDs, nombres y números).
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class _BatchingStreamHandler(logging.StreamHandler):
+    """StreamHandler que no vacía el buffer en cada registro: lo hace el listener por lotes"""
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class _LogWriter:
+    """Hilo que vacía la cola de registros: escribe todo lo que haya y hace un solo flush por lote"""
+
+    _STOP = object()
+
+    def __init__(self, records, handler):
+        self.records, self.handler = records, handler
+        self._thread = threading.Thread(target=self._run, daemon=True, name="logging")
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.records.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            record = self.records.get()
+            while record is not self._STOP:
+                self.handler.handle(record)
+                try:
+                    record = self.records.get_nowait()
+                except queue.Empty:
+                    break
+            self.handler.flush()
+            if record is self._STOP:
+                return
+
+
+_listener = None  # _LogWriter activo de configure_logging()
+
+
+def stop_logging():
+    """Escribe lo que quede en la cola y detiene el hilo escritor (se llama también al salir)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+def configure_logging(level=None, stream=None):
+    """Logging con buffer: los mensajes van a una cola y un hilo aparte los formatea y escribe en 'stream'.
+
+    Quien atiende la petición no formatea ni espera al 'stream' (un pipe lleno, un disco
+    lento), y el escritor hace un flush por lote en vez de uno por mensaje; bench_instrumentation
+    lo compara con el modo síncrono. El nivel sale de 'level' o de LOG_LEVEL (INFO por defecto);
+    los mensajes por tarea son DEBUG, así que con INFO ni siquiera se crean. Si se llama otra
+    vez, el escritor anterior se detiene antes de poner el nuevo.
+    """
+    global _listener
+    stop_logging()
+    level = level or os.environ.get("LOG_LEVEL", "INFO")
+    handler = _BatchingStreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [_DeferredQueueHandler(records)]
+    root.setLevel(level)
+    _listener = _LogWriter(records, handler)
+    _listener.start()
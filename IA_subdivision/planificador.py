@@ -0,0 +1,131 @@
+import heapq
+from collections import namedtuple
+
+# Recursos que declara una tarea en task_data['requirements'] (None = sin exigencia)
+Requirements = namedtuple("Requirements", ["cores", "ram_GB", "max_temp"])
+NO_REQUIREMENTS = Requirements(None, None, None)
+DEFAULT_TASK_TYPE = "default"  # Tipo de las tareas sin task_data['type']
+
+
+def task_requirements(task):
+    """Requisitos declarados en task_data['requirements']: cores, ram_GB y max_temp"""
+    data = task.get('data')
+    req = data.get('requirements') if isinstance(data, dict) else None
+    if not req:
+        return NO_REQUIREMENTS
+    return Requirements(req.get('cores'), req.get('ram_GB'), req.get('max_temp'))
+
+
+def task_priority(task):
+    """Prioridad en task_data['priority'] (mayor = antes), 0 por defecto"""
+    data = task.get('data')
+    return (data.get('priority') or 0) if isinstance(data, dict) else 0
+
+
+def task_type(task):
+    """Tipo de la tarea (task_data['type']) o DEFAULT_TASK_TYPE"""
+    data = task.get('data')
+    return (data.get('type') if isinstance(data, dict) else None) or DEFAULT_TASK_TYPE
+
+
+def node_resources(node_data):
+    """Recursos libres de un nodo según su última entrada de nodes_data.
+
+    Devuelve {cores, ram_GB, temp}; un valor None significa que no se conoce y
+    no se usa para descartar tareas.
+    """
+    cores, cpu = node_data.get("cpu_cores"), node_data.get("cpu_percent")
+    ram_total, ram = node_data.get("ram_total_GB"), node_data.get("ram_percent")
+    return {
+        "cores": None if cores is None or cpu is None else round(cores * (100 - cpu) / 100),
+        "ram_GB": None if ram_total is None or ram is None else ram_total * (100 - ram) / 100,
+        "temp": node_data.get("cpu_temp")
+    }
+
+
+def fits(req, free):
+    if req.cores is not None and free["cores"] is not None and req.cores > free["cores"]:
+        return False
+    if req.ram_GB is not None and free["ram_GB"] is not None and req.ram_GB > free["ram_GB"]:
+        return False
+    if req.max_temp is not None and free["temp"] is not None and free["temp"] > req.max_temp:
+        return False
+    return True
+
+
+class TaskScheduler:
+    """Cola de tareas pendientes con prioridades y requisitos de recursos.
+
+    Las tareas se agrupan por requisitos (cores, ram_GB, max_temp) y tipo, y cada grupo
+    es un montículo ordenado por prioridad y antigüedad (task_id). Para un nodo se
+    miran solo las cabezas de los grupos cuyos requisitos caben en sus recursos
+    libres, así que elegir tarea cuesta O(grupos + log N) en lugar de recorrer la cola.
+    No es thread-safe: el maestro la usa siempre bajo _task_lock.
+    """
+
+    def __init__(self):
+        self._groups = {}  # {(Requirements, tipo): [(-prioridad, task_id, tarea)]}
+        self._size = 0
+
+    def put(self, task):
+        key = (task_requirements(task), task_type(task))
+        heapq.heappush(self._groups.setdefault(key, []),
+                       (-task_priority(task), task['task_id'], task))
+        self._size += 1
+
+    def qsize(self):
+        return self._size
+
+    def empty(self):
+        return self._size == 0
+
+    @property
+    def queue(self):
+        """Tareas pendientes en orden de salida (prioridad y antigüedad), para snapshots"""
+        entries = [entry for heap in self._groups.values() for entry in heap]
+        return [task for _, _, task in sorted(entries, key=lambda entry: entry[:2])]
+
+    def _best_group(self, free, cost=None):
+        best, best_rank = None, None
+        for key, heap in self._groups.items():
+            if free is not None and not fits(key[0], free):
+                continue
+            priority, task_id, _ = heap[0]
+            rank = (priority, cost(key[1]), task_id) if cost else (priority, task_id)
+            if best is None or rank < best_rank:
+                best, best_rank = key, rank
+        return best
+
+    def has_task_for(self, free=None):
+        """¿Hay alguna tarea que quepa en los recursos libres 'free' (None = cualquiera)?"""
+        if free is None:
+            return self._size > 0
+        return any(fits(req, free) for req, _ in self._groups)
+
+    def peek(self):
+        """Próxima tarea en salir sin restricciones de recursos, sin sacarla (None si está vacía)"""
+        key = self._best_group(None)
+        return self._groups[key][0][2] if key is not None else None
+
+    def get_for(self, free=None, cost=None):
+        """Saca la tarea de mayor prioridad que cabe en 'free', o None si no hay ninguna.
+
+        Con cost(tipo), entre las de la misma prioridad sale la de menor coste y, a igual
+        coste, la más antigua. Los recursos de la tarea se descuentan de 'free', de modo
+        que un lote de llamadas seguidas no asigna a un nodo más de lo que tiene libre.
+        """
+        key = self._best_group(free, cost)
+        if key is None:
+            return None
+        req = key[0]
+        heap = self._groups[key]
+        _, _, task = heapq.heappop(heap)
+        if not heap:
+            del self._groups[key]
+        self._size -= 1
+        if free is not None:
+            if req.cores is not None and free["cores"] is not None:
+                free["cores"] -= req.cores
+            if req.ram_GB is not None and free["ram_GB"] is not None:
+                free["ram_GB"] -= req.ram_GB
+        return task
@@ -0,0 +1,184 @@
+import heapq
+
+import numpy as np
+
+# Orden de los componentes de la puntuación en score_components
+WEIGHT_KEYS = ("cpu_availability", "ram_availability", "temperature", "energy_efficiency", "historical_performance")
+
+
+class NodeMetricsTable:
+    """Métricas de los nodos en columnas NumPy para puntuar todo el clúster de golpe"""
+
+    def __init__(self, capacity=64):
+        self.node_ids = []
+        self.index = {}  # {node_id: fila}
+        self.cpu = np.empty(capacity)
+        self.ram = np.empty(capacity)
+        self.temp = np.empty(capacity)  # NaN = sin sensor de temperatura
+        self.energy = np.empty(capacity)
+        self.success_rate = np.empty(capacity)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __contains__(self, node_id):
+        return node_id in self.index
+
+    def _grow(self):
+        capacity = self.cpu.shape[0] * 2
+        for column in ("cpu", "ram", "temp", "energy", "success_rate"):
+            old = getattr(self, column)
+            new = np.empty(capacity)
+            new[:old.shape[0]] = old
+            setattr(self, column, new)
+
+    def upsert(self, node_id, node_data, energy=100, success_rate=0.5):
+        """Inserta o actualiza la fila de un nodo"""
+        row = self.index.get(node_id)
+        if row is None:
+            row = len(self.node_ids)
+            if row == self.cpu.shape[0]:
+                self._grow()
+            self.node_ids.append(node_id)
+            self.index[node_id] = row
+
+        cpu_percent = node_data.get("cpu_percent")
+        ram_percent = node_data.get("ram_percent")
+        cpu_temp = node_data.get("cpu_temp")
+        self.cpu[row] = 100 if cpu_percent is None else cpu_percent
+        self.ram[row] = 100 if ram_percent is None else ram_percent
+        self.temp[row] = np.nan if cpu_temp is None else cpu_temp
+        self.energy[row] = energy
+        self.success_rate[row] = success_rate
+
+    def set_energy(self, node_id, energy):
+        row = self.index.get(node_id)
+        if row is not None:
+            self.energy[row] = energy
+
+    def set_success_rate(self, node_id, success_rate):
+        row = self.index.get(node_id)
+        if row is not None:
+            self.success_rate[row] = success_rate
+
+    def remove(self, node_id):
+        """Elimina un nodo moviendo la última fila a su hueco"""
+        row = self.index.pop(node_id, None)
+        if row is None:
+            return
+        last = len(self.node_ids) - 1
+        if row != last:
+            moved = self.node_ids[last]
+            self.node_ids[row] = moved
+            self.index[moved] = row
+            for column in (self.cpu, self.ram, self.temp, self.energy, self.success_rate):
+                column[row] = column[last]
+        self.node_ids.pop()
+
+    def scores(self, weights, config, max_energy):
+        """Puntuaciones de todos los nodos (mismo cálculo que calculate_node_score)"""
+        n = len(self.node_ids)
+        components, critical = score_components(
+            self.cpu[:n], self.ram[:n], self.temp[:n], self.energy[:n], self.success_rate[:n], config, max_energy
+        )
+        final = components @ np.array([weights[key] for key in WEIGHT_KEYS])
+        final[critical] = 0.0
+        return final
+
+
+def score_components(cpu, ram, temp, energy, success_rate, config, max_energy):
+    """Componentes de la puntuación (última dimensión en el orden de WEIGHT_KEYS) y máscara de nodos críticos.
+
+    Acepta arrays de cualquier forma compatible (p. ej. instantes x nodos con la energía
+    por nodo), así que sirve para puntuar de golpe un histórico entero con muchos juegos de pesos.
+    """
+    has_temp = ~np.isnan(temp)
+    components = np.stack(np.broadcast_arrays(
+        (100 - cpu) / 100,
+        (100 - ram) / 100,
+        np.where(has_temp, np.maximum(0, (config["temp_max"] - temp) / config["temp_max"]), 0.5),
+        1 - (energy / max_energy),
+        success_rate
+    ), axis=-1)
+
+    # Nodos en estado crítico (una temperatura de 0 no cuenta como crítica, igual que antes)
+    critical = (
+            (has_temp & (temp != 0) & (temp > config["temp_max"])) |
+            (ram > config["ram_critical"]) |
+            (cpu > config["cpu_critical"])
+    )
+    return components, critical
+
+
+class NodeScoreIndex:
+    """Índice de nodos por puntuación (un montículo por system_load) con invalidación perezosa"""
+
+    LOADS = ("low", "normal", "high")
+
+    def __init__(self):
+        self._heaps = {load: [] for load in self.LOADS}
+        self._scores = {load: {} for load in self.LOADS}
+
+    def _load(self, system_load):
+        # Cualquier otra carga se puntúa como "normal" en calculate_node_score
+        return system_load if system_load in self._scores else "normal"
+
+    def __len__(self):
+        return len(self._scores["normal"])
+
+    def rebuild(self, system_load, scores):
+        """Reconstruye el índice de una carga a partir de todas las puntuaciones, O(N)"""
+        load = self._load(system_load)
+        self._scores[load] = dict(scores)
+        heap = [(-score, node_id) for node_id, score in scores.items()]
+        heapq.heapify(heap)
+        self._heaps[load] = heap
+
+    def update(self, node_id, system_load, score):
+        """Actualiza la puntuación de un nodo en O(log N)"""
+        load = self._load(system_load)
+        scores = self._scores[load]
+        if scores.get(node_id) == score:
+            return
+        scores[node_id] = score
+        heap = self._heaps[load]
+        heapq.heappush(heap, (-score, node_id))
+        # Las entradas obsoletas se descartan al consultar; si se acumulan, compactar
+        if len(heap) > 2 * len(scores) + 64:
+            self.rebuild(load, scores)
+
+    def remove(self, node_id):
+        for scores in self._scores.values():
+            scores.pop(node_id, None)
+
+    def get_score(self, node_id, system_load="normal"):
+        return self._scores[self._load(system_load)].get(node_id)
+
+    def get_scores(self, system_load="normal"):
+        return self._scores[self._load(system_load)]
+
+    def _is_current(self, load, entry):
+        return self._scores[load].get(entry[1]) == -entry[0]
+
+    def best(self, system_load="normal"):
+        """Mejor nodo y su puntuación, o (None, 0) si no hay nodos"""
+        load = self._load(system_load)
+        heap = self._heaps[load]
+        while heap and not self._is_current(load, heap[0]):
+            heapq.heappop(heap)
+        if not heap:
+            return None, 0
+        return heap[0][1], -heap[0][0]
+
+    def top(self, system_load="normal", k=1):
+        """Los k mejores nodos como lista de (node_id, score), O(k log N)"""
+        load = self._load(system_load)
+        heap = self._heaps[load]
+        result = []
+        while heap and len(result) < k:
+            entry = heapq.heappop(heap)
+            if self._is_current(load, entry) and (not result or result[-1][0] != entry[1]):
+                result.append((entry[1], -entry[0]))
+        for node_id, score in result:
+            heapq.heappush(heap, (-score, node_id))
+        return result
@@ -0,0 +1,341 @@
+import logging
+import math
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+
+import numpy as np
+
+# Valores que se guardan de cada muestra (NaN = no enviado, p. ej. sin sensor de temperatura)
+SERIES_FIELDS = ("cpu_percent", "ram_percent", "cpu_temp", "power_watts")
+# Agregados: duración del tramo en segundos
+ROLLUPS = {"1m": 60, "1h": 3600}
+ROLLUP_COLUMNS = (("samples",) + tuple(f"{field}_avg" for field in SERIES_FIELDS) +
+                  tuple(f"{field}_max" for field in SERIES_FIELDS))
+DB_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+log = logging.getLogger("series_metricas")
+
+
+class _Ring:
+    """Anillo de 'capacity' instantes por nodo: una fila por nodo, timestamps float64 y valores float32"""
+
+    def __init__(self, capacity, width, rows):
+        self.capacity = capacity
+        self.ts = np.zeros((rows, capacity))
+        self.values = np.full((rows, capacity, width), np.nan, dtype=np.float32)
+        self.count = np.zeros(rows, dtype=np.int64)  # instantes escritos desde el principio
+
+    @property
+    def nbytes(self):
+        return self.ts.nbytes + self.values.nbytes + self.count.nbytes
+
+    def grow(self, rows):
+        old_rows = self.ts.shape[0]
+        ts = np.zeros((rows, self.capacity))
+        values = np.full((rows, self.capacity, self.values.shape[2]), np.nan, dtype=np.float32)
+        count = np.zeros(rows, dtype=np.int64)
+        ts[:old_rows], values[:old_rows], count[:old_rows] = self.ts, self.values, self.count
+        self.ts, self.values, self.count = ts, values, count
+
+    def push(self, row, ts, values):
+        pos = self.count[row] % self.capacity
+        self.ts[row, pos] = ts
+        self.values[row, pos] = values
+        self.count[row] += 1
+
+    def _order(self, row):
+        """Posiciones del anillo de la más antigua a la más reciente"""
+        count = int(self.count[row])
+        return np.arange(max(0, count - self.capacity), count) % self.capacity
+
+    def oldest(self, row):
+        if self.count[row] == 0:
+            return None
+        return self.ts[row, self._order(row)[0]]
+
+    def range(self, row, since=None, until=None):
+        """(timestamps, valores) con since <= t <= until; búsqueda binaria sobre el anillo ordenado"""
+        order = self._order(row)
+        ts = self.ts[row, order]
+        lo = 0 if since is None else np.searchsorted(ts, since, side="left")
+        hi = len(ts) if until is None else np.searchsorted(ts, until, side="right")
+        order = order[lo:hi]
+        return self.ts[row, order], self.values[row, order]
+
+
+class _OpenBuckets:
+    """Tramo en curso de un nivel de agregación (suma, cuenta y máximo por campo y nodo).
+
+    Son pocos valores por nodo y se tocan en cada muestra, así que van en listas de
+    Python: operar con arrays NumPy de 4 elementos cuesta más que el propio cálculo.
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.rows = []  # por fila: [inicio, muestras, sumas, cuentas, máximos]; se crea con la primera muestra
+
+    @property
+    def nbytes(self):
+        return len(self.rows) * 8 * (2 + 3 * len(SERIES_FIELDS))
+
+    def aggregate(self, row):
+        """Fila con las columnas de ROLLUP_COLUMNS para el tramo en curso"""
+        _, samples, sums, counts, maxs = self.rows[row]
+        return ([samples] + [total / n if n else np.nan for total, n in zip(sums, counts)] +
+                [peak if n else np.nan for peak, n in zip(maxs, counts)])
+
+    def start(self, row):
+        return self.rows[row][0] if row < len(self.rows) else None
+
+    def samples(self, row):
+        return self.rows[row][1] if row < len(self.rows) else 0
+
+    def add(self, row, ts, values):
+        """Suma la muestra a su tramo; si empieza uno nuevo devuelve (inicio, agregado) del que se cierra.
+
+        values lleva None en los campos que faltan.
+        """
+        start = ts - ts % self.period
+        closed = None
+        if row == len(self.rows):
+            self.rows.append(None)
+        state = self.rows[row]
+        if state is None or state[0] != start:
+            if state is not None:
+                closed = (state[0], self.aggregate(row))
+            fields = len(SERIES_FIELDS)
+            state = self.rows[row] = [start, 0, [0.0] * fields, [0] * fields, [-math.inf] * fields]
+        state[1] += 1
+        sums, counts, maxs = state[2], state[3], state[4]
+        for i, value in enumerate(values):
+            if value is not None:
+                sums[i] += value
+                counts[i] += 1
+                if value > maxs[i]:
+                    maxs[i] = value
+        return closed
+
+
+def load_cluster_metrics(path):
+    """Muestras de cluster_metrics en orden temporal, desde un volcado .sql (metricas.sql) o una base SQLite.
+
+    Cada muestra es {node_id, timestamp (epoch), cpu_percent, ram_percent, cpu_temp, power_watts, job_id}.
+    """
+    if path.endswith(".sql"):
+        db = sqlite3.connect(":memory:")
+        with open(path, encoding="utf-8") as f:
+            db.executescript(f.read())
+    else:
+        db = sqlite3.connect(path)
+    rows = db.execute("SELECT Node_ID, Timestamp, CPU_Usage_pct, RAM_Usage_pct, Temp_CPU_C, Power_Watts, Job_ID "
+                      "FROM cluster_metrics ORDER BY Timestamp, Node_ID").fetchall()
+    db.close()
+    return [{
+        "node_id": node_id,
+        "timestamp": datetime.fromisoformat(timestamp).timestamp(),
+        "cpu_percent": cpu, "ram_percent": ram, "cpu_temp": temp, "power_watts": power,
+        "job_id": job_id
+    } for node_id, timestamp, cpu, ram, temp, power, job_id in rows]
+
+
+def _column(values):
+    """Lista JSON de una columna (NaN pasa a None)"""
+    return [None if v != v else round(float(v), 2) for v in values]
+
+
+class MetricsSeriesStore:
+    """Series temporales de métricas por nodo, en memoria acotada.
+
+    Cada nodo tiene una fila en tres anillos NumPy: las últimas 'capacity' muestras
+    en bruto y los agregados de 1 minuto y 1 hora (media y máximo). Con db_path las
+    muestras se vuelcan por lotes a la tabla cluster_metrics (esquema de metricas.sql)
+    y las consultas en bruto anteriores al anillo se completan desde el disco. Los
+    lotes los escribe un hilo aparte: el maestro llama a record() con _nodes_lock
+    cogido y la escritura en SQLite no debe frenar la puntuación ni los leases.
+    Se suponen timestamps no decrecientes por nodo; uno anterior se toma como el último.
+    """
+
+    FLUSH_EVERY = 500  # muestras pendientes que se escriben juntas en disco
+
+    def __init__(self, capacity=300, minute_capacity=120, hour_capacity=168, db_path=None, rows=64):
+        self.node_ids = []
+        self.index = {}  # {node_id: fila}
+        self.raw = _Ring(capacity, len(SERIES_FIELDS), rows)
+        self.rollups = {
+            "1m": _Ring(minute_capacity, len(ROLLUP_COLUMNS), rows),
+            "1h": _Ring(hour_capacity, len(ROLLUP_COLUMNS), rows)
+        }
+        self._open = {name: _OpenBuckets(period) for name, period in ROLLUPS.items()}
+        self._last_ts = np.full(rows, -np.inf)
+        self._lock = threading.Lock()
+
+        self._pending = []  # filas de cluster_metrics aún no escritas
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writes = queue.Queue()  # lotes para el hilo escritor (None lo detiene)
+        self._writer = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS cluster_metrics (
+                    Node_ID VARCHAR(4) not null,
+                    Timestamp TIME,
+                    CPU_Usage_pct INT,
+                    RAM_Usage_pct INT,
+                    Temp_CPU_C INT,
+                    Power_Watts INT,
+                    Job_ID VARCHAR(7)
+                )""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_cluster_metrics_node "
+                             "ON cluster_metrics (Node_ID, Timestamp)")
+            self._db.commit()
+            self._writer = threading.Thread(target=self._write_loop, daemon=True, name="series-db")
+            self._writer.start()
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __contains__(self, node_id):
+        return node_id in self.index
+
+    @property
+    def nbytes(self):
+        """Memoria que ocupan los arrays (crece solo con el número de nodos)"""
+        return (self.raw.nbytes + sum(ring.nbytes for ring in self.rollups.values()) +
+                sum(buckets.nbytes for buckets in self._open.values()) + self._last_ts.nbytes)
+
+    def _row(self, node_id):
+        row = self.index.get(node_id)
+        if row is None:
+            row = len(self.node_ids)
+            if row == self._last_ts.shape[0]:
+                rows = row * 2
+                for ring in [self.raw, *self.rollups.values()]:
+                    ring.grow(rows)
+                last_ts = np.full(rows, -np.inf)
+                last_ts[:row] = self._last_ts
+                self._last_ts = last_ts
+            self.node_ids.append(node_id)
+            self.index[node_id] = row
+        return row
+
+    def record(self, node_id, timestamp, sample, job_id=None):
+        """Guarda una muestra {cpu_percent, ram_percent, cpu_temp, power_watts} en O(1)"""
+        values = [sample.get(field) for field in SERIES_FIELDS]
+        batch = None
+        with self._lock:
+            row = self._row(node_id)
+            timestamp = max(timestamp, self._last_ts[row])
+            # La fecha se calcula antes de tocar nada: si está fuera de rango la muestra no entra
+            db_time = datetime.fromtimestamp(timestamp).strftime(DB_TIME_FORMAT) if self._db is not None else None
+            self._last_ts[row] = timestamp
+            self.raw.push(row, timestamp, values)
+            for name, buckets in self._open.items():
+                closed = buckets.add(row, timestamp, values)
+                if closed is not None:
+                    self.rollups[name].push(row, *closed)
+
+            if self._db is not None:
+                self._pending.append((
+                    node_id, db_time,
+                    *[None if v is None else int(round(v)) for v in values], job_id
+                ))
+                if len(self._pending) >= self.FLUSH_EVERY:
+                    batch, self._pending = self._pending, []
+        if batch:
+            self._writes.put(batch)
+
+    def _write_loop(self):
+        while True:
+            batch = self._writes.get()
+            try:
+                if batch is None:
+                    return
+                with self._db_lock:
+                    self._db.executemany("INSERT INTO cluster_metrics VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+                    self._db.commit()
+            except Exception:
+                log.exception("❌ Error escribiendo %d muestras en cluster_metrics", len(batch))
+            finally:
+                self._writes.task_done()
+
+    def flush(self):
+        """Encola lo pendiente y espera a que el hilo escritor lo tenga en disco"""
+        if self._db is None:
+            return
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if batch:
+            self._writes.put(batch)
+        self._writes.join()
+
+    def query(self, node_id, since=None, until=None, resolution="raw"):
+        """Serie de un nodo entre since y until (epoch en segundos) como columnas.
+
+        resolution: "raw" (muestras), "1m" o "1h" (agregados; incluye el tramo en curso).
+        Devuelve None si el nodo no tiene métricas.
+        """
+        if resolution != "raw" and resolution not in ROLLUPS:
+            raise ValueError(f"resolution debe ser raw, {' o '.join(ROLLUPS)}")
+        for bound in (since, until):
+            if bound is not None:
+                try:
+                    datetime.fromtimestamp(bound)  # Lo mismo que hará _query_db con ellos
+                except (ValueError, OverflowError, OSError):
+                    raise ValueError(f"since/until fuera de rango: {bound}")
+        with self._lock:
+            row = self.index.get(node_id)
+            if row is None:
+                return None
+            if resolution == "raw":
+                ts, values = self.raw.range(row, since, until)
+                oldest = self.raw.oldest(row)
+            else:
+                ts, values = self.rollups[resolution].range(row, since, until)
+                buckets = self._open[resolution]
+                start = buckets.start(row)
+                if buckets.samples(row) and (since is None or start >= since) and (until is None or start <= until):
+                    ts = np.append(ts, start)
+                    values = np.vstack([values, buckets.aggregate(row)])
+
+        columns = SERIES_FIELDS if resolution == "raw" else ROLLUP_COLUMNS
+        series = {"node_id": node_id, "resolution": resolution, "timestamp": ts.tolist()}
+        series.update({column: _column(values[:, i]) for i, column in enumerate(columns)})
+
+        # Lo que ya salió del anillo se lee de cluster_metrics
+        if resolution == "raw" and self._db is not None and (since is None or oldest is None or since < oldest):
+            if oldest is not None and (until is None or oldest <= until):
+                older = self._query_db(node_id, since, oldest, exclusive=True)
+            else:
+                older = self._query_db(node_id, since, until, exclusive=False)
+            for column, values in older.items():
+                series[column] = values + series[column]
+        return series
+
+    def _query_db(self, node_id, since, until, exclusive):
+        """Muestras de cluster_metrics (precisión de segundos) en el formato de query()"""
+        self.flush()
+        sql = "SELECT Timestamp, CPU_Usage_pct, RAM_Usage_pct, Temp_CPU_C, Power_Watts FROM cluster_metrics WHERE Node_ID = ?"
+        params = [node_id]
+        if since is not None:
+            sql += " AND Timestamp >= ?"
+            params.append(datetime.fromtimestamp(since).strftime(DB_TIME_FORMAT))
+        if until is not None:
+            sql += " AND Timestamp < ?" if exclusive else " AND Timestamp <= ?"
+            params.append(datetime.fromtimestamp(until).strftime(DB_TIME_FORMAT))
+        sql += " ORDER BY Timestamp"
+        with self._db_lock:
+            rows = self._db.execute(sql, params).fetchall()
+        older = {"timestamp": [datetime.strptime(row[0], DB_TIME_FORMAT).timestamp() for row in rows]}
+        for i, field in enumerate(SERIES_FIELDS, start=1):
+            older[field] = [row[i] for row in rows]
+        return older
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._writes.put(None)
+            self._writer.join()
+            self._db.close()
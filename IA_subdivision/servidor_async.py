@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from quart import Quart, Response, g, request, jsonify
+
+from agente import (MasterAgent, PROMETHEUS_CONTENT_TYPE, handle_register, handle_update_metrics,
+                    handle_update_metrics_bulk, handle_request_task, handle_complete_task, handle_add_task,
+                    handle_completed_tasks, handle_metrics_history, handle_energy_report, handle_runtime_stats,
+                    handle_prometheus_metrics, handle_profile, handle_status, observe_request)
+from instrumentacion import SamplingProfiler, configure_logging
+from federacion import (FederatedMasterAgent, handle_route, handle_federated_add_task, handle_steal,
+                        handle_confirm, handle_federation_status)
+
+# === SERVIDOR ASÍNCRONO (ASGI) ===
+# Mismos endpoints y misma lógica que agente.py, servidos con Quart sobre asyncio.
+# Todo lo que toma los locks del maestro o escribe en el WAL/SQLite (y puede esperar a
+# un fsync), el long-poll de /request_task y las consultas a Ollama se ejecutan en un
+# pool de hilos propio: en el bucle de eventos solo se lee la petición y se responde.
+
+app = Quart(__name__)
+master = None
+profiler = None  # SamplingProfiler opcional (--profile)
+
+# Hilos para las llamadas bloqueantes: cada long-poll ocupa uno mientras espera
+blocking_pool = ThreadPoolExecutor(max_workers=256, thread_name_prefix="bloqueante")
+
+
+async def run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_pool, func, *args)
+
+
+@app.before_serving
+async def init_master():
+    # Con "hypercorn servidor_async:app" no se pasa por __main__
+    global master
+    if master is None:
+        master = MasterAgent()
+    master.start_reaper()
+
+
+@app.before_request
+async def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+async def observe_request_latency(response):
+    start = getattr(g, 'request_start', None)
+    if start is not None:
+        observe_request(request.url_rule, request.method, response.status_code, start)
+    return response
+
+
+@app.route('/register', methods=['POST'])
+async def register_node():
+    body, code = await run_blocking(handle_register, master, await request.get_json())
+    return jsonify(body), code
+
+
+@app.route('/update_metrics', methods=['POST'])
+async def update_metrics():
+    body, code = await run_blocking(handle_update_metrics, master, await request.get_json(), request.remote_addr)
+    return jsonify(body), code
+
+
+@app.route('/update_metrics_bulk', methods=['POST'])
+async def update_metrics_bulk():
+    body, code = await run_blocking(handle_update_metrics_bulk, master, await request.get_json(), request.remote_addr)
+    return jsonify(body), code
+
+
+@app.route('/request_task', methods=['POST'])
+async def request_task():
+    """Endpoint para que un esclavo pida una tarea"""
+    body, code = await run_blocking(handle_request_task, master, await request.get_json(), request.remote_addr)
+    return jsonify(body), code
+
+
+@app.route('/complete_task', methods=['POST'])
+async def complete_task():
+    """Endpoint para reportar tarea completada (o un lote en 'results')"""
+    body, code = await run_blocking(handle_complete_task, master, await request.get_json())
+    return jsonify(body), code
+
+
+@app.route('/add_task', methods=['POST'])
+async def add_task():
+    """Endpoint para añadir tareas a la cola"""
+    body, code = await run_blocking(handle_add_task, master, await request.get_json())
+    return jsonify(body), code
+
+
+@app.route('/queue_status', methods=['GET'])
+async def queue_status():
+    """Endpoint para ver el estado de la cola"""
+    return jsonify(await run_blocking(master.get_queue_status)), 200
+
+
+@app.route('/completed_tasks', methods=['GET'])
+async def completed_tasks():
+    """Endpoint para consultar el historial de tareas completadas"""
+    body, code = await run_blocking(handle_completed_tasks, master, request.args)
+    return jsonify(body), code
+
+
+@app.route('/metrics_history', methods=['GET'])
+async def metrics_history():
+    """Endpoint para consultar la serie temporal de métricas de un nodo"""
+    body, code = await run_blocking(handle_metrics_history, master, request.args)
+    return jsonify(body), code
+
+
+@app.route('/energy_report', methods=['GET'])
+async def energy_report():
+    """Energía estimada frente a repartir por igual y nodos candidatos a aparcarse"""
+    body, code = await run_blocking(handle_energy_report, master)
+    return jsonify(body), code
+
+
+@app.route('/runtime_stats', methods=['GET'])
+async def runtime_stats():
+    """Tiempos de ejecución por nodo y tipo de tarea (media, desviación y cuantiles)"""
+    body, code = await run_blocking(handle_runtime_stats, master)
+    return jsonify(body), code
+
+
+@app.route('/metrics', methods=['GET'])
+async def prometheus_metrics():
+    """Latencias, contadores y gauges en formato Prometheus"""
+    body, code = await run_blocking(handle_prometheus_metrics, master)
+    return Response(body, status=code, content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.route('/debug/profile', methods=['GET'])
+async def debug_profile():
+    """Pilas del perfilador por muestreo (si está activo)"""
+    body, code = handle_profile(profiler, request.args)
+    return Response(body, status=code, mimetype="text/plain")
+
+
+@app.route('/status', methods=['GET'])
+async def get_status():
+    """Estado completo del clúster"""
+    body, code = await run_blocking(handle_status, master)
+    return jsonify(body), code
+
+
+@app.route('/federation/route', methods=['GET'])
+async def federation_route():
+    """Shard al que tiene que hablar un esclavo"""
+    body, code = handle_route(master, request.args)
+    return jsonify(body), code
+
+
+@app.route('/federation/add_task', methods=['POST'])
+async def federation_add_task():
+    body, code = await run_blocking(handle_federated_add_task, master, await request.get_json())
+    return jsonify(body), code
+
+
+@app.route('/federation/steal', methods=['POST'])
+async def federation_steal():
+    """Otro shard se ha quedado sin trabajo y pide tareas"""
+    body, code = await run_blocking(handle_steal, master, await request.get_json())
+    return jsonify(body), code
+
+
+@app.route('/federation/confirm', methods=['POST'])
+async def federation_confirm():
+    body, code = await run_blocking(handle_confirm, master, await request.get_json())
+    return jsonify(body), code
+
+
+@app.route('/federation/status', methods=['GET'])
+async def federation_status():
+    body, code = await run_blocking(handle_federation_status, master)
+    return jsonify(body), code
+
+
+@app.route('/get_best_node_ollama', methods=['GET'])
+async def get_best_node_ollama():
+    """Mejor nodo usando Ollama, sin bloquear el bucle de eventos"""
+    if not hasattr(master, 'select_best_node_with_ollama'):
+        return jsonify({"error": "Ollama no configurado"}), 500
+
+    system_load = request.args.get('system_load', 'normal')
+    best_node, score, all_scores = await run_blocking(master.select_best_node_with_ollama, system_load)
+
+    return jsonify({
+        "best_node": best_node,
+        "score": round(score, 3) if score else 0,
+        "all_scores": {k: round(v, 3) for k, v in all_scores.items()},
+        "method": "ollama+scoring",
+        "timestamp": datetime.now().isoformat()
+    }), 200
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor maestro asíncrono")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--ollama", action="store_true", help="Usar MasterAgentWithOllama")
+    parser.add_argument("--weights", help="Perfil de pesos generado por ajuste_pesos.py")
+    parser.add_argument("--shard-urls", help="Modo federado: URLs de todos los maestros separadas por comas")
+    parser.add_argument("--index", type=int, default=0, help="Posición de este maestro en --shard-urls")
+    parser.add_argument("--profile", type=float, metavar="INTERVALO",
+                        help="Activa el perfilador por muestreo (segundos entre muestras) en /debug/profile")
+    parser.add_argument("--placement", default="score", choices=["score", "ect"],
+                        help="ect: asignar al nodo que terminaría antes según sus tiempos por tipo de tarea")
+    args = parser.parse_args()
+
+    configure_logging()
+    if args.profile:
+        profiler = SamplingProfiler(args.profile)
+        profiler.start()
+
+    custom_weights = {
+        "cpu_availability": 0.35,
+        "ram_availability": 0.30,
+        "temperature": 0.15,
+        "energy_efficiency": 0.15,
+        "historical_performance": 0.05
+    }
+
+    if args.ollama:
+        from agente_ollama import MasterAgentWithOllama
+        master = MasterAgentWithOllama(weights=args.weights or custom_weights, use_ollama=True, ollama_model='llama2',
+                                       completed_db='tareas_completadas.db', metrics_db='metricas_cluster.db',
+                                       placement=args.placement)
+    elif args.shard_urls:
+        master = FederatedMasterAgent(args.shard_urls.split(","), args.index,
+                                      weights=args.weights or custom_weights,
+                                      completed_db=f'tareas_completadas_{args.index}.db',
+                                      metrics_db=f'metricas_cluster_{args.index}.db', placement=args.placement)
+    else:
+        master = MasterAgent(weights=args.weights or custom_weights, completed_db='tareas_completadas.db',
+                             metrics_db='metricas_cluster.db', placement=args.placement)
+
+    print("\n🚀 Servidor maestro asíncrono (ASGI) iniciado")
+    print(f"📡 Mismos endpoints que agente.py en el puerto {args.port}\n")
+
+    try:
+        app.run(host='0.0.0.0', port=args.port, debug=False, use_reloader=False)
+    finally:
+        master.stop_reaper()
+        master.close()
@@ -0,0 +1,334 @@
+import argparse
+import contextlib
+import heapq
+import logging
+import math
+import os
+import random
+import time
+from collections import namedtuple
+
+from agente import MasterAgent
+from series_metricas import load_cluster_metrics
+
+# === SIMULADOR DE PLANIFICACIÓN ===
+# Reproduce una traza sobre un MasterAgent real con un reloj virtual: las llegadas de
+# tareas, la carga de fondo de cada nodo y la ejecución de las tareas son eventos, y
+# el maestro decide con add_task, update_node_data, get_best_node,
+# get_next_task_for_node y complete_task igual que con esclavos de verdad.
+
+METRICAS_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "metricas.sql")
+
+# node_id, núcleos, RAM (GB), vatios registrados, velocidad relativa y, opcionalmente,
+# un factor de velocidad por tipo de tarea ({tipo: factor}, p. ej. nodos con GPU)
+SimNodeSpec = namedtuple("SimNodeSpec", ["node_id", "cores", "ram_GB", "watts", "speed", "type_speed"],
+                         defaults=(None,))
+# background: {node_id: [(t, cpu, ram, temp, power)]}; tasks: [(llegada, trabajo en s, task_data)]
+Trace = namedtuple("Trace", ["nodes", "background", "tasks"])
+
+# Tipos de tarea sintéticos: trabajo medio en segundos de un núcleo y requisitos
+TASK_TYPES = {
+    "train_model": (1800, {"cores": 2, "ram_GB": 4, "max_temp": 80}),
+    "process_data": (300, {"ram_GB": 1}),
+    "simulation": (900, None)
+}
+
+
+class VirtualClock:
+    """Reloj que solo avanza cuando el simulador pasa al siguiente evento"""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _synthetic_tasks(rng, n_tasks, start, duration):
+    tasks = []
+    for _ in range(n_tasks):
+        task_type = rng.choice(list(TASK_TYPES))
+        mean_work, requirements = TASK_TYPES[task_type]
+        task_data = {"type": task_type, "priority": rng.randint(0, 2)}
+        if requirements:
+            task_data["requirements"] = requirements
+        tasks.append((start + rng.uniform(0, duration), rng.expovariate(1 / mean_work), task_data))
+    tasks.sort(key=lambda task: task[0])
+    return tasks
+
+
+def trace_from_cluster_metrics(path=METRICAS_SQL, n_tasks=2000, cores=8, ram_GB=16, seed=0):
+    """Traza con la carga de fondo de cluster_metrics (metricas.sql) y tareas sintéticas.
+
+    La tabla no guarda núcleos ni RAM total, así que todos los nodos tienen 'cores' y
+    'ram_GB'; los vatios registrados son la media de Power_Watts de cada nodo.
+    """
+    rng = random.Random(seed)
+    background = {}
+    for sample in load_cluster_metrics(path):
+        background.setdefault(sample["node_id"], []).append((
+            sample["timestamp"], sample["cpu_percent"], sample["ram_percent"],
+            sample["cpu_temp"], sample["power_watts"]
+        ))
+    nodes = [SimNodeSpec(node_id, cores, ram_GB, sum(s[4] for s in samples) / len(samples), 1.0)
+             for node_id, samples in sorted(background.items())]
+    start = min(samples[0][0] for samples in background.values())
+    end = max(samples[-1][0] for samples in background.values())
+    return Trace(nodes, background, _synthetic_tasks(rng, n_tasks, start, end - start))
+
+
+# Hardware especializado de la traza sintética: probabilidad y factor por tipo de tarea
+SPECIALIZED_HARDWARE = ((0.15, {"train_model": 4.0}), (0.15, {"process_data": 3.0, "simulation": 0.5}))
+
+
+def synthetic_trace(n_nodes=1000, n_tasks=100000, duration=86400, tick=600, seed=0):
+    """Traza sintética: nodos heterogéneos con carga de fondo en paseo aleatorio cada 'tick' segundos.
+
+    Algunos nodos son mucho más rápidos en un tipo de tarea (SPECIALIZED_HARDWARE).
+    """
+    rng = random.Random(seed)
+    nodes, background = [], {}
+    for i in range(n_nodes):
+        draw, type_speed, threshold = rng.random(), None, 0.0
+        for probability, factors in SPECIALIZED_HARDWARE:
+            threshold += probability
+            if draw < threshold:
+                type_speed = factors
+                break
+        spec = SimNodeSpec(f"node_{i}", rng.choice([4, 8, 16]), rng.choice([8, 16, 32]),
+                           rng.randint(60, 250), rng.uniform(0.5, 2.0), type_speed)
+        nodes.append(spec)
+        cpu, ram, temp = rng.uniform(0, 40), rng.uniform(10, 60), rng.uniform(35, 60)
+        samples = []
+        for t in range(0, duration + tick, tick):
+            cpu = min(90, max(0, cpu + rng.gauss(0, 5)))
+            ram = min(90, max(5, ram + rng.gauss(0, 3)))
+            temp = min(95, max(30, temp + rng.gauss(0, 2)))
+            samples.append((float(t), cpu, ram, temp, spec.watts * (0.4 + 0.6 * cpu / 100)))
+        background[spec.node_id] = samples
+    return Trace(nodes, background, _synthetic_tasks(rng, n_tasks, 0.0, duration))
+
+
+class _SimNode:
+    __slots__ = ("spec", "running", "ram_used", "bg_index", "cpu", "ram", "temp", "power")
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.running = 0
+        self.ram_used = 0.0
+        self.bg_index = 0
+        self.cpu = self.ram = self.temp = self.power = None
+
+    def metrics(self):
+        """Lo que el esclavo enviaría en /update_metrics: fondo más las tareas en marcha"""
+        cores = self.spec.cores
+        return {
+            "cpu_cores": cores,
+            "cpu_percent": min(100.0, self.cpu + 100 * self.running / cores),
+            "ram_total_GB": self.spec.ram_GB,
+            "ram_percent": min(100.0, self.ram + 100 * self.ram_used / self.spec.ram_GB),
+            "cpu_temp": None if self.temp is None else self.temp + 20 * self.running / cores
+        }
+
+
+@contextlib.contextmanager
+def _quiet_logs():
+    """Sin los mensajes del maestro (lease vencidos, nodos expulsados...) durante la simulación"""
+    logging.disable(logging.CRITICAL)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def simulate(trace, weights=None, system_load="normal", candidates=16, **master_kwargs):
+    """Reproduce la traza y devuelve las métricas de la planificación.
+
+    En cada paso, mientras haya tareas pendientes, se asignan al mejor nodo con núcleos
+    libres (get_best_node y, si está lleno, hasta 'candidates' de get_top_nodes).
+    Una tarea ocupa los núcleos de sus requisitos (1 por defecto) y dura
+    trabajo * (1 + cpu de fondo) / velocidad (por el factor de su tipo, si el nodo
+    lo tiene), un 50% más si el nodo pasa de 85 °C;
+    falla si no cabe en la RAM libre y se vuelve a encolar.
+    """
+    start_time = min(samples[0][0] for samples in trace.background.values())
+    clock = VirtualClock(start_time)
+    master = MasterAgent(weights=weights, clock=clock, **master_kwargs)
+    nodes = {spec.node_id: _SimNode(spec) for spec in trace.nodes}
+
+    events = []  # (tiempo, seq, tipo, datos)
+    seq = 0
+    arrivals = {}  # {task_id: (llegada, trabajo)}
+    stats = {"completed": 0, "failures": 0, "decisions": 0, "decision_time": 0.0, "wait": 0.0,
+             "energy_trace_J": 0.0, "energy_registered_J": 0.0, "last_completion": start_time}
+    total_slots = free_slots = sum(spec.cores for spec in trace.nodes)
+
+    def push(t, kind, data):
+        nonlocal seq
+        seq += 1
+        heapq.heappush(events, (t, seq, kind, data))
+
+    def apply_background(node):
+        t, node.cpu, node.ram, node.temp, node.power = trace.background[node.spec.node_id][node.bg_index]
+        master.update_node_data(node.spec.node_id, node.metrics())
+        samples = trace.background[node.spec.node_id]
+        node.bg_index += 1
+        if node.bg_index < len(samples):
+            push(samples[node.bg_index][0], "background", node)
+
+    def start_task(node, task):
+        nonlocal free_slots
+        arrival, work = arrivals[task['task_id']]
+        requirements = task['data'].get('requirements') or {}
+        ram = requirements.get('ram_GB') or 0
+        slots = min(requirements.get('cores') or 1, node.spec.cores)
+        # Falla si la tarea no cabe en la RAM que de verdad queda libre en el nodo
+        success = node.ram * node.spec.ram_GB / 100 + node.ram_used + ram <= node.spec.ram_GB
+        speed = node.spec.speed * (node.spec.type_speed or {}).get(task['data'].get('type'), 1.0)
+        runtime = work * (1 + node.cpu / 100) / speed
+        if node.temp is not None and node.temp + 20 * node.running / node.spec.cores > 85:
+            runtime *= 1.5
+        if not success:
+            runtime = min(runtime, 30.0)  # El fallo se detecta enseguida
+        node.running += slots
+        node.ram_used += ram
+        free_slots -= slots
+        stats["wait"] += clock.now - arrival
+        # Energía atribuible a la tarea: la parte de la potencia del nodo de sus núcleos
+        share = runtime * slots / node.spec.cores
+        stats["energy_trace_J"] += node.power * share
+        stats["energy_registered_J"] += master.energy_consumption[node.spec.node_id] * share
+        master.update_node_data(node.spec.node_id, node.metrics())
+        push(clock.now + runtime, "done", (node, task, slots, ram, success))
+
+    def finish_task(node, task, slots, ram, success):
+        nonlocal free_slots
+        node.running -= slots
+        node.ram_used -= ram
+        free_slots += slots
+        master.complete_task(task['task_id'], node.spec.node_id, None, success)
+        master.update_node_data(node.spec.node_id, node.metrics())
+        _, work = arrivals.pop(task['task_id'])
+        if success:
+            stats["completed"] += 1
+            stats["last_completion"] = clock.now
+        else:
+            stats["failures"] += 1
+            arrivals[master.add_task(task['data'])] = (clock.now, work)
+
+    def dispatch():
+        while free_slots and not master.task_queue.empty():
+            t0 = time.perf_counter()
+            best, _ = master.get_best_node(system_load)
+            options = [best] if best is not None else []
+            if best is None or nodes[best].running >= nodes[best].spec.cores:
+                options = [node_id for node_id, _ in master.get_top_nodes(system_load, candidates)]
+            task = None
+            for node_id in options:
+                node = nodes[node_id]
+                if node.running < node.spec.cores:
+                    task = master.get_next_task_for_node(node_id)
+                    if task is not None:
+                        break
+            stats["decision_time"] += time.perf_counter() - t0
+            if task is None:
+                return  # Ningún candidato libre puede con lo pendiente: se espera al siguiente evento
+            stats["decisions"] += 1
+            start_task(node, task)
+
+    wall_start = time.perf_counter()
+    with _quiet_logs():
+        for spec in trace.nodes:
+            master.register_node(spec.node_id, spec.watts)
+        for node in nodes.values():
+            apply_background(node)
+
+        tasks = trace.tasks
+        next_arrival = 0
+        while events or next_arrival < len(tasks):
+            arrival_time = tasks[next_arrival][0] if next_arrival < len(tasks) else math.inf
+            clock.now = min(arrival_time, events[0][0] if events else math.inf)
+            while next_arrival < len(tasks) and tasks[next_arrival][0] <= clock.now:
+                arrival, work, task_data = tasks[next_arrival]
+                arrivals[master.add_task(task_data)] = (arrival, work)
+                next_arrival += 1
+            while events and events[0][0] <= clock.now:
+                _, _, kind, data = heapq.heappop(events)
+                if kind == "background":
+                    apply_background(data)
+                else:
+                    finish_task(*data)
+            dispatch()
+            if next_arrival == len(tasks) and free_slots == total_slots:
+                # Todo terminado, o lo que queda no cabe en ningún nodo libre: el resto
+                # de la carga de fondo ya no cambia el resultado
+                if master.task_queue.empty() or not any(kind == "background" for _, _, kind, _ in events):
+                    break
+    wall = time.perf_counter() - wall_start
+
+    first_arrival = tasks[0][0] if tasks else start_time
+    started = stats["decisions"] or 1
+    return {
+        "tasks": len(tasks),
+        "completed": stats["completed"],
+        "failures": stats["failures"],
+        "unscheduled": master.task_queue.qsize(),
+        "makespan_h": (stats["last_completion"] - first_arrival) / 3600,
+        "mean_wait_s": stats["wait"] / started,
+        "energy_trace_kWh": stats["energy_trace_J"] / 3.6e6,
+        "energy_registered_kWh": stats["energy_registered_J"] / 3.6e6,
+        "decisions_per_s": stats["decisions"] / stats["decision_time"] if stats["decision_time"] else 0.0,
+        "wall_s": wall
+    }
+
+
+def compare(trace, configs):
+    """Simula la traza con cada configuración {label, weights, system_load, ...} y muestra una tabla"""
+    print(f"\n📊 {len(trace.nodes)} nodos, {len(trace.tasks)} tareas")
+    print(f"   {'configuración':<24} {'makespan':>9} {'espera':>8} {'kWh traza':>10} {'kWh reg.':>9} "
+          f"{'fallos':>7} {'sin nodo':>8} {'decis./s':>9} {'tiempo':>7}")
+    results = {}
+    for config in configs:
+        config = dict(config)
+        label = config.pop("label")
+        result = simulate(trace, **config)
+        results[label] = result
+        print(f"   {label:<24} {result['makespan_h']:8.1f}h {result['mean_wait_s']:7.0f}s "
+              f"{result['energy_trace_kWh']:10.1f} {result['energy_registered_kWh']:9.1f} "
+              f"{result['failures']:7d} {result['unscheduled']:8d} {result['decisions_per_s']:9.0f} "
+              f"{result['wall_s']:6.1f}s")
+    return results
+
+
+CUSTOM_WEIGHTS = {
+    "cpu_availability": 0.35,
+    "ram_availability": 0.30,
+    "temperature": 0.15,
+    "energy_efficiency": 0.15,
+    "historical_performance": 0.05
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulador de planificación sobre trazas")
+    parser.add_argument("--trace", default=METRICAS_SQL, help="Volcado .sql o base SQLite con cluster_metrics")
+    parser.add_argument("--synthetic", nargs=2, type=int, metavar=("NODOS", "TAREAS"),
+                        help="Traza sintética en lugar de --trace")
+    parser.add_argument("--tasks", type=int, default=2000, help="Tareas sintéticas sobre --trace")
+    parser.add_argument("--loads", nargs="+", default=["low", "normal", "high"])
+    args = parser.parse_args()
+
+    if args.synthetic:
+        trace = synthetic_trace(*args.synthetic)
+    else:
+        trace = trace_from_cluster_metrics(args.trace, n_tasks=args.tasks)
+
+    configs = []
+    for system_load in args.loads:
+        configs.append({"label": f"por defecto / {system_load}", "system_load": system_load})
+        configs.append({"label": f"custom / {system_load}", "weights": CUSTOM_WEIGHTS, "system_load": system_load})
+        configs.append({"label": f"tiempo esperado / {system_load}", "system_load": system_load,
+                        "placement": "ect"})
+    if "low" in args.loads:
+        configs.append({"label": "consolidación / low", "system_load": "low", "consolidate": True})
+    compare(trace, configs)
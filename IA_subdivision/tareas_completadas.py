@@ -0,0 +1,168 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+from collections import deque
+
+log = logging.getLogger("tareas_completadas")
+
+
+class CompletedTaskStore:
+    """Historial acotado de tareas completadas.
+
+    Las últimas 'capacity' quedan en memoria (anillo); las más antiguas se vuelcan
+    por lotes a SQLite si hay db_path, o se descartan si no lo hay. Los lotes los
+    escribe un hilo aparte porque append() se llama con el _task_lock del maestro
+    cogido; close() guarda también el anillo.
+    """
+
+    FLUSH_EVERY = 100  # entradas expulsadas que se escriben juntas en disco
+
+    def __init__(self, capacity=1000, db_path=None):
+        self.recent = deque()
+        self.capacity = capacity
+        self.total = 0
+        self._spilled = []  # expulsadas del anillo pendientes de escribir
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writes = queue.Queue()  # lotes para el hilo escritor (None lo detiene)
+        self._writer = None
+        self._last_rowid = 0  # rowid de la última fila entregada al escritor
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS completed_tasks (
+                    task_id INTEGER,
+                    node_id TEXT,
+                    elapsed_time REAL,
+                    success INTEGER,
+                    result TEXT,
+                    completed_at TEXT
+                )""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_completed_node "
+                             "ON completed_tasks (node_id, completed_at)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_completed_at ON completed_tasks (completed_at)")
+            self._db.commit()
+            self._last_rowid = self._db.execute("SELECT COALESCE(MAX(rowid), 0) FROM completed_tasks").fetchone()[0]
+            self._writer = threading.Thread(target=self._write_loop, daemon=True, name="completadas-db")
+            self._writer.start()
+
+    def __len__(self):
+        return self.total
+
+    def append(self, entry):
+        """Añade una tarea completada en O(1) (amortizado)"""
+        with self._lock:
+            self.recent.append(entry)
+            self.total += 1
+            if len(self.recent) > self.capacity:
+                oldest = self.recent.popleft()
+                if self._db is not None:
+                    self._spilled.append(oldest)
+                    if len(self._spilled) >= self.FLUSH_EVERY:
+                        self._hand_off(self._spilled)
+                        self._spilled = []
+
+    def _hand_off(self, entries):
+        """Entrega un lote al hilo escritor (bajo _lock, para que los rowid sigan el orden)"""
+        if entries:
+            self._writes.put(list(entries))
+            self._last_rowid += len(entries)
+
+    def _write_loop(self):
+        while True:
+            entries = self._writes.get()
+            try:
+                if entries is None:
+                    return
+                with self._db_lock:
+                    self._db.executemany(
+                        "INSERT INTO completed_tasks VALUES (?, ?, ?, ?, ?, ?)",
+                        [(e['task_id'], e['node_id'], e['elapsed_time'], int(bool(e['success'])),
+                          json.dumps(e['result'], default=str), e['completed_at']) for e in entries]
+                    )
+                    self._db.commit()
+            except Exception:
+                log.exception("❌ Error escribiendo %d tareas completadas", len(entries))
+            finally:
+                self._writes.task_done()
+
+    def flush(self):
+        """Escribe las expulsadas pendientes y espera a que estén en disco"""
+        if self._db is None:
+            return
+        with self._lock:
+            self._hand_off(self._spilled)
+            self._spilled = []
+        self._writes.join()
+
+    def close(self):
+        """Escribe en disco las pendientes y las del anillo y cierra la base de datos"""
+        if self._db is None:
+            return
+        with self._lock:
+            self._hand_off(self._spilled + list(self.recent))
+            self._spilled = []
+        self._writes.put(None)
+        self._writer.join()
+        self._db.close()
+        self._db = None
+
+    @staticmethod
+    def _matches(entry, node_id, since, until, success):
+        return ((node_id is None or entry['node_id'] == node_id) and
+                (since is None or entry['completed_at'] >= since) and
+                (until is None or entry['completed_at'] <= until) and
+                (success is None or bool(entry['success']) == success))
+
+    def query(self, node_id=None, since=None, until=None, success=None, offset=0, limit=100):
+        """Tareas completadas más recientes primero, filtradas y paginadas.
+
+        since/until son fechas ISO (mismo formato que completed_at).
+        """
+        with self._lock:
+            # Primero las de memoria (las más recientes), después las del disco
+            matches = [entry for entry in reversed(self.recent)
+                       if self._matches(entry, node_id, since, until, success)]
+            if offset + limit <= len(matches) or self._db is None:
+                return matches[offset:offset + limit]
+            self._hand_off(self._spilled)
+            self._spilled = []
+            # Solo las filas que ya estaban fuera del anillo al copiarlo: las expulsadas
+            # después de soltar el lock saldrían repetidas
+            last_rowid = self._last_rowid
+
+        # La espera al escritor y la consulta van fuera de _lock para no frenar append()
+        self._writes.join()
+        page = matches[offset:]
+        where, params = ["rowid <= ?"], [last_rowid]
+        if node_id is not None:
+            where.append("node_id = ?")
+            params.append(node_id)
+        if since is not None:
+            where.append("completed_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("completed_at <= ?")
+            params.append(until)
+        if success is not None:
+            where.append("success = ?")
+            params.append(int(success))
+        sql = "SELECT task_id, node_id, elapsed_time, success, result, completed_at FROM completed_tasks"
+        sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY rowid DESC LIMIT ? OFFSET ?"
+        params += [limit - len(page), max(0, offset - len(matches))]
+        with self._db_lock:
+            rows = self._db.execute(sql, params).fetchall()
+        for task_id, node, elapsed_time, ok, result, completed_at in rows:
+            page.append({
+                'task_id': task_id,
+                'node_id': node,
+                'elapsed_time': elapsed_time,
+                'success': bool(ok),
+                'result': json.loads(result),
+                'completed_at': completed_at
+            })
+        return page
@@ -0,0 +1,60 @@
+import math
+
+# Métricas de carga cuya tendencia se sigue (las de porcentaje se limitan a 0-100)
+TREND_FIELDS = ("cpu_percent", "ram_percent", "cpu_temp")
+PERCENT_FIELDS = ("cpu_percent", "ram_percent")
+
+
+class TrendTracker:
+    """Nivel suavizado (EWMA) y tendencia lineal por nodo y métrica (método de Holt).
+
+    Las muestras llegan a intervalos irregulares, así que el factor de suavizado
+    sale de una constante de tiempo: alpha = 1 - exp(-dt / tau). Cada muestra se
+    procesa en O(1) y la predicción a 'horizon' segundos es nivel + tendencia * horizon.
+    """
+
+    def __init__(self, level_tau=10.0, trend_tau=30.0):
+        self.level_tau = level_tau
+        self.trend_tau = trend_tau
+        self._state = {}  # {node_id: {campo: [nivel, tendencia por segundo, último timestamp]}}
+
+    def __contains__(self, node_id):
+        return node_id in self._state
+
+    def update(self, node_id, timestamp, sample):
+        """Incorpora una muestra; los campos None (p. ej. sin sensor) no cambian su estado"""
+        state = self._state.setdefault(node_id, {})
+        for field in TREND_FIELDS:
+            value = sample.get(field)
+            if value is None:
+                continue
+            entry = state.get(field)
+            if entry is None:
+                state[field] = [value, 0.0, timestamp]
+                continue
+            level, trend, last = entry
+            dt = timestamp - last
+            if dt <= 0:
+                # Muestra del mismo instante: solo corrige el nivel
+                entry[0] = level + (1 - math.exp(-1 / self.level_tau)) * (value - level)
+                continue
+            alpha = 1 - math.exp(-dt / self.level_tau)
+            beta = 1 - math.exp(-dt / self.trend_tau)
+            predicted = level + trend * dt
+            new_level = predicted + alpha * (value - predicted)
+            entry[1] = trend + beta * ((new_level - level) / dt - trend)
+            entry[0] = new_level
+            entry[2] = timestamp
+
+    def forecast(self, node_id, horizon):
+        """Valores previstos dentro de 'horizon' segundos ({} si el nodo no tiene estado)"""
+        predicted = {}
+        for field, (level, trend, _) in self._state.get(node_id, {}).items():
+            value = level + trend * horizon
+            if field in PERCENT_FIELDS:
+                value = min(100.0, max(0.0, value))
+            predicted[field] = value
+        return predicted
+
+    def remove(self, node_id):
+        self._state.pop(node_id, None)
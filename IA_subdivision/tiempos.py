@@ -0,0 +1,193 @@
+import math
+
+# Tiempos de ejecución por (nodo, tipo de tarea): media y varianza incrementales (Welford)
+# y cuantiles con un sketch de cubos logarítmicos. Con ellos el maestro estima cuánto
+# tardará cada nodo en una tarea y puede asignarla al que la terminaría antes.
+
+QUANTILES = (0.5, 0.9, 0.99)  # Los que se muestran en summary()
+
+
+class QuantileSketch:
+    """Cuantiles aproximados en memoria acotada (cubos logarítmicos, estilo DDSketch).
+
+    Cada valor cae en el cubo ceil(log_gamma(x)) y el cuantil devuelto tiene un error
+    relativo de como mucho 'accuracy'. Con accuracy=0.01, de 1 ms a 1 día bastan ~600 cubos.
+    """
+
+    def __init__(self, accuracy=0.01, min_value=1e-3):
+        self.accuracy = accuracy
+        self.min_value = min_value
+        self._gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = {}  # {índice: cuenta}
+        self.zero = 0  # Valores <= min_value
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= self.min_value:
+            self.zero += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def quantile(self, q):
+        """Valor aproximado del cuantil q (0-1), None si no hay muestras"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self._gamma ** index / (self._gamma + 1)
+        return 2 * self._gamma ** max(self.buckets) / (self._gamma + 1)
+
+    def to_dict(self):
+        return {'accuracy': self.accuracy, 'min_value': self.min_value, 'zero': self.zero,
+                'buckets': {str(index): n for index, n in self.buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['accuracy'], data['min_value'])
+        sketch.zero = data['zero']
+        sketch.buckets = {int(index): n for index, n in data['buckets'].items()}
+        sketch.count = sketch.zero + sum(sketch.buckets.values())
+        return sketch
+
+
+class RuntimeStats:
+    """Número de muestras, media, varianza y cuantiles de un tiempo de ejecución"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0  # Suma de cuadrados de las desviaciones (Welford)
+        self.sketch = QuantileSketch()
+
+    def add(self, seconds):
+        self.count += 1
+        delta = seconds - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (seconds - self.mean)
+        self.sketch.add(seconds)
+
+    @property
+    def variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def quantile(self, q):
+        return self.sketch.quantile(q)
+
+    def summary(self):
+        summary = {'count': self.count, 'mean': self.mean, 'std': math.sqrt(self.variance)}
+        for q in QUANTILES:
+            summary[f'p{round(q * 100)}'] = self.quantile(q)
+        return summary
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'm2': self._m2, 'sketch': self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.count, stats.mean, stats._m2 = data['count'], data['mean'], data['m2']
+        stats.sketch = QuantileSketch.from_dict(data['sketch'])
+        return stats
+
+
+class RuntimeModel:
+    """Estadísticas de tiempo de ejecución por (nodo, tipo de tarea) y por tipo en todo el clúster.
+
+    expected() mezcla la media del par con una estimación a priori, ponderadas por número
+    de muestras (prior_weight muestras equivalen a la estimación a priori). La estimación a
+    priori es la media del tipo en el clúster multiplicada por lo rápido o lento que ha sido
+    el nodo con los otros tipos, o default_seconds si el tipo no se ha visto nunca.
+    No es thread-safe: el maestro la usa bajo _nodes_lock.
+    """
+
+    def __init__(self, default_seconds=60.0, prior_weight=2.0):
+        self.default_seconds = default_seconds
+        self.prior_weight = prior_weight
+        self._pairs = {}  # {(node_id, tipo): RuntimeStats}
+        self._types = {}  # {tipo: RuntimeStats} de todos los nodos
+        self._node_types = {}  # {node_id: {tipo: RuntimeStats}}
+
+    def record(self, node_id, task_type, seconds):
+        """Añade el tiempo de una ejecución con éxito"""
+        stats = self._pairs.get((node_id, task_type))
+        if stats is None:
+            stats = self._pairs[(node_id, task_type)] = RuntimeStats()
+            self._node_types.setdefault(node_id, {})[task_type] = stats
+        stats.add(seconds)
+        self._types.setdefault(task_type, RuntimeStats()).add(seconds)
+
+    def get(self, node_id, task_type):
+        """RuntimeStats del par, o None si el nodo no ha completado ese tipo"""
+        return self._pairs.get((node_id, task_type))
+
+    def task_types(self):
+        return list(self._types)
+
+    def type_mean(self, task_type):
+        """Duración media del tipo en el clúster (default_seconds si no hay muestras)"""
+        stats = self._types.get(task_type)
+        return max(stats.mean, 1e-6) if stats is not None else self.default_seconds
+
+    def node_factor(self, node_id, exclude=None):
+        """Cuánto tarda el nodo respecto a la media del clúster en los tipos que ha ejecutado"""
+        total = weight = 0.0
+        for task_type, stats in self._node_types.get(node_id, {}).items():
+            if task_type != exclude:
+                total += stats.count * stats.mean / self.type_mean(task_type)
+                weight += stats.count
+        return total / weight if weight else 1.0
+
+    def expected(self, node_id, task_type):
+        """Duración esperada de una tarea del tipo en el nodo"""
+        return self.expected_many([node_id], task_type)[0]
+
+    def expected_many(self, node_ids, task_type):
+        """expected() de varios nodos para el mismo tipo, con las medias por tipo calculadas una vez"""
+        means = {kind: max(stats.mean, 1e-6) for kind, stats in self._types.items()}
+        type_mean = means.get(task_type, self.default_seconds)
+        expected = []
+        for node_id in node_ids:
+            pair, total, weight = None, 0.0, 0.0
+            for kind, stats in self._node_types.get(node_id, {}).items():
+                if kind == task_type:
+                    pair = stats
+                else:
+                    total += stats.count * stats.mean / means[kind]
+                    weight += stats.count
+            prior = type_mean * (total / weight if weight else 1.0)
+            if pair is None:
+                expected.append(prior)
+            else:
+                expected.append((pair.count * pair.mean + self.prior_weight * prior) / (pair.count + self.prior_weight))
+        return expected
+
+    def relative(self, node_id, task_type):
+        """Duración esperada en el nodo dividida por la media del tipo (<1: el nodo es rápido en él)"""
+        return self.expected(node_id, task_type) / self.type_mean(task_type)
+
+    def summary(self):
+        """{node_id: {tipo: count, mean, std, p50, p90, p99}} y los totales por tipo"""
+        nodes = {}
+        for (node_id, task_type), stats in self._pairs.items():
+            nodes.setdefault(node_id, {})[task_type] = stats.summary()
+        return {'nodes': nodes, 'types': {task_type: stats.summary() for task_type, stats in self._types.items()}}
+
+    def to_dict(self):
+        return {'pairs': [[node_id, task_type, stats.to_dict()] for (node_id, task_type), stats in self._pairs.items()],
+                'types': {task_type: stats.to_dict() for task_type, stats in self._types.items()}}
+
+    def load(self, data):
+        """Restaura el estado de to_dict() (snapshot del WAL)"""
+        self._types = {task_type: RuntimeStats.from_dict(stats) for task_type, stats in data['types'].items()}
+        self._pairs, self._node_types = {}, {}
+        for node_id, task_type, stats in data['pairs']:
+            stats = self._pairs[(node_id, task_type)] = RuntimeStats.from_dict(stats)
+            self._node_types.setdefault(node_id, {})[task_type] = stats